@@ -1,16 +1,19 @@
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageFilter
+from PIL import Image, ImageDraw
 import tkinter as tk
-from tkinter import filedialog, Button, Label, Canvas, Scale, IntVar, Frame, HORIZONTAL, Radiobutton, Entry, StringVar, messagebox
+from tkinter import filedialog, Button, Label, Canvas, Scale, IntVar, Frame, HORIZONTAL, Radiobutton, Checkbutton, BooleanVar, Entry, StringVar, messagebox
 from PIL import ImageTk
 import os
 import json
-import base64
 import io
 import threading
 import traceback
-from openai import OpenAI
+
+import engine
+import instrumentation
+import openai_client
+import vision_upload
+from result_cache import ResultCache
+from live_preview import LivePreview
 
 class AdvancedImageToCharacterApp:
     def __init__(self, root):
@@ -20,8 +23,11 @@ class AdvancedImageToCharacterApp:
         
         self.input_image_path = None
         self.output_image = None
-        self.processed_edges = None
-        self.contours = None
+        
+        # 変換結果のキャッシュ（スライダーを戻して再変換したときなどに使う）
+        self.result_cache = ResultCache(max_entries=32)
+        # 段階ごとの中間結果（読み込み・エッジ・輪郭など）を覚えておくパイプライン
+        self.pipeline = engine.StagedPipeline()
         
         # APIキー関連
         self.api_key = StringVar()
@@ -33,10 +39,14 @@ class AdvancedImageToCharacterApp:
         self.contour_simplification = IntVar(value=10)  # 0.01 * 1000 = 10
         self.line_thickness = IntVar(value=5)
         self.style_option = IntVar(value=0)  # 0: 輪郭のみ, 1: 塗りつぶし, 2: テクスチャ付き
+        self.multi_contour = BooleanVar(value=False)  # 複数の輪郭と穴を描く
         
         # APIキーの読み込み
         self.load_api_key()
         
+        # スライダーを動かしたときのライブプレビュー
+        self.live_preview = LivePreview(self.root, self.get_params, self.show_preview)
+        
         # UIの設定
         self.setup_ui()
     
@@ -47,7 +57,7 @@ class AdvancedImageToCharacterApp:
                     data = json.load(f)
                     self.api_key.set(data.get("api_key", ""))
                     if self.api_key.get():
-                        self.client = OpenAI(api_key=self.api_key.get())
+                        self.client = openai_client.get_client(api_key=self.api_key.get())
                         print("OpenAIクライアントを初期化しました")
         except Exception as e:
             print(f"APIキーの読み込みエラー: {str(e)}")
@@ -58,7 +68,7 @@ class AdvancedImageToCharacterApp:
             if api_key:
                 with open("api_key.json", "w") as f:
                     json.dump({"api_key": api_key}, f)
-                self.client = OpenAI(api_key=api_key)
+                self.client = openai_client.get_client(api_key=api_key)
                 messagebox.showinfo("成功", "APIキーが保存されました")
                 print("OpenAIクライアントを初期化しました")
             else:
@@ -131,31 +141,36 @@ class AdvancedImageToCharacterApp:
         # Cannyエッジ検出のしきい値1
         Label(param_frame, text="エッジ検出 しきい値1:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=2)
         Scale(param_frame, from_=0, to=255, orient=HORIZONTAL, variable=self.canny_threshold1, 
-              length=200).grid(row=0, column=1, padx=5, pady=2)
+              length=200, command=self.live_preview.schedule).grid(row=0, column=1, padx=5, pady=2)
         
         # Cannyエッジ検出のしきい値2
         Label(param_frame, text="エッジ検出 しきい値2:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=2)
         Scale(param_frame, from_=0, to=255, orient=HORIZONTAL, variable=self.canny_threshold2, 
-              length=200).grid(row=1, column=1, padx=5, pady=2)
+              length=200, command=self.live_preview.schedule).grid(row=1, column=1, padx=5, pady=2)
         
         # 輪郭の単純化レベル
         Label(param_frame, text="輪郭の単純化レベル:").grid(row=0, column=2, sticky=tk.W, padx=5, pady=2)
         Scale(param_frame, from_=1, to=100, orient=HORIZONTAL, variable=self.contour_simplification, 
-              length=200).grid(row=0, column=3, padx=5, pady=2)
+              length=200, command=self.live_preview.schedule).grid(row=0, column=3, padx=5, pady=2)
         
         # 線の太さ
         Label(param_frame, text="線の太さ:").grid(row=1, column=2, sticky=tk.W, padx=5, pady=2)
         Scale(param_frame, from_=1, to=20, orient=HORIZONTAL, variable=self.line_thickness, 
-              length=200).grid(row=1, column=3, padx=5, pady=2)
+              length=200, command=self.live_preview.schedule).grid(row=1, column=3, padx=5, pady=2)
         
         # スタイルオプション
         style_frame = Frame(param_frame)
         style_frame.grid(row=2, column=0, columnspan=4, sticky=tk.W, padx=5, pady=5)
         
         Label(style_frame, text="スタイル:").pack(side=tk.LEFT, padx=5)
-        Radiobutton(style_frame, text="輪郭のみ", variable=self.style_option, value=0).pack(side=tk.LEFT, padx=10)
-        Radiobutton(style_frame, text="塗りつぶし", variable=self.style_option, value=1).pack(side=tk.LEFT, padx=10)
-        Radiobutton(style_frame, text="テクスチャ付き", variable=self.style_option, value=2).pack(side=tk.LEFT, padx=10)
+        Radiobutton(style_frame, text="輪郭のみ", variable=self.style_option, value=0,
+                    command=self.live_preview.schedule).pack(side=tk.LEFT, padx=10)
+        Radiobutton(style_frame, text="塗りつぶし", variable=self.style_option, value=1,
+                    command=self.live_preview.schedule).pack(side=tk.LEFT, padx=10)
+        Radiobutton(style_frame, text="テクスチャ付き", variable=self.style_option, value=2,
+                    command=self.live_preview.schedule).pack(side=tk.LEFT, padx=10)
+        Checkbutton(style_frame, text="複数の輪郭を使う", variable=self.multi_contour,
+                    command=self.live_preview.schedule).pack(side=tk.LEFT, padx=10)
         
         # ChatGPTからの説明テキスト表示用フレーム
         self.description_frame = tk.Frame(self.root)
@@ -183,6 +198,7 @@ class AdvancedImageToCharacterApp:
         if file_path:
             self.input_image_path = file_path
             self.display_input_image()
+            self.live_preview.set_image(file_path)
             self.convert_btn.config(state=tk.NORMAL)
             self.chatgpt_btn.config(state=tk.NORMAL if self.api_key.get() else tk.DISABLED)
             self.status_label.config(text=f"選択された画像: {os.path.basename(file_path)}")
@@ -212,11 +228,13 @@ class AdvancedImageToCharacterApp:
         if not self.input_image_path:
             return
         
+        # 確定の変換を行うので、保留中のプレビューは表示しない
+        self.live_preview.cancel()
         self.status_label.config(text="変換中...")
         self.root.update()
         
         # 画像から特徴を抽出し、象形文字を生成
-        self.output_image = self.generate_character_from_image(self.input_image_path)
+        self.output_image = self.generate_character_from_image(self.input_image_path, self.get_params())
         
         # 結果を表示
         self.display_output_image()
@@ -243,14 +261,16 @@ class AdvancedImageToCharacterApp:
             messagebox.showerror("エラー", f"ChatGPTとの通信中にエラーが発生しました: {str(e)}")
             print(f"エラー詳細: {traceback.format_exc()}")
     
+    @instrumentation.traced("advanced_version_with_chatgpt.chatgpt")
     def _process_with_chatgpt(self):
         try:
-            # 画像をBase64エンコード
+            # 画像を縮小・再圧縮してBase64エンコード（元の写真をそのまま送るより小さくなる）
             with open(self.input_image_path, "rb") as image_file:
-                encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
+                image_url, report = vision_upload.prepare_vision_image(image_file.read())
+            print(f"送信する画像: {vision_upload.format_report(report)}")
             
             # ChatGPTに画像を送信して象形文字を生成
-            response = self.client.chat.completions.create(
+            response = self.client.chat_completion(
                 model="gpt-4o",
                 messages=[
                     {
@@ -267,13 +287,14 @@ class AdvancedImageToCharacterApp:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{encoded_image}"
+                                    "url": image_url
                                 }
                             }
                         ]
                     }
                 ],
-                max_tokens=1000
+                max_tokens=1000,
+                deadline=60
             )
             
             # 応答を取得
@@ -374,108 +395,58 @@ class AdvancedImageToCharacterApp:
         self.status_label.config(text="エラーが発生しました")
         messagebox.showerror("エラー", f"ChatGPTとの通信中にエラーが発生しました: {error_message}")
     
-    def generate_character_from_image(self, image_path):
-        # 画像を読み込み
-        img = cv2.imread(image_path)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # エッジ検出（パラメータ調整可能）
-        edges = cv2.Canny(gray, self.canny_threshold1.get(), self.canny_threshold2.get())
-        self.processed_edges = edges.copy()
-        
-        # 輪郭検出
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        self.contours = contours
-        
-        # 最も大きい輪郭を取得
-        if contours:
-            main_contour = max(contours, key=cv2.contourArea)
-            
-            # 輪郭を単純化（パラメータ調整可能）
-            epsilon = (self.contour_simplification.get() / 1000) * cv2.arcLength(main_contour, True)
-            approx_contour = cv2.approxPolyDP(main_contour, epsilon, True)
-            
-            # 象形文字のような画像を生成
-            canvas_size = (500, 500)
-            character_img = Image.new('RGB', canvas_size, color='white')
-            draw = ImageDraw.Draw(character_img)
-            
-            # 輪郭の座標を正規化して描画
-            h, w = edges.shape
-            scale_x = canvas_size[0] / w
-            scale_y = canvas_size[1] / h
-            
-            # 中心に配置するためのオフセットを計算
-            x_min = min(point[0][0] for point in approx_contour)
-            y_min = min(point[0][1] for point in approx_contour)
-            x_max = max(point[0][0] for point in approx_contour)
-            y_max = max(point[0][1] for point in approx_contour)
-            
-            contour_width = x_max - x_min
-            contour_height = y_max - y_min
-            
-            offset_x = (w - contour_width) // 2 - x_min
-            offset_y = (h - contour_height) // 2 - y_min
-            
-            # 輪郭を描画
-            points = []
-            for point in approx_contour:
-                x = int((point[0][0] + offset_x) * scale_x)
-                y = int((point[0][1] + offset_y) * scale_y)
-                points.append((x, y))
-            
-            # スタイルに応じて描画
-            style = self.style_option.get()
-            
-            if style == 0:  # 輪郭のみ
-                for i in range(len(points)):
-                    start = points[i]
-                    end = points[(i + 1) % len(points)]
-                    draw.line([start, end], fill='black', width=self.line_thickness.get())
-            
-            elif style == 1:  # 塗りつぶし
-                draw.polygon(points, outline='black', fill='black')
-            
-            elif style == 2:  # テクスチャ付き
-                # まず輪郭を描画
-                for i in range(len(points)):
-                    start = points[i]
-                    end = points[(i + 1) % len(points)]
-                    draw.line([start, end], fill='black', width=self.line_thickness.get())
-                
-                # テクスチャ効果（ノイズや筆のストロークを模倣）
-                texture_img = character_img.copy()
-                draw_texture = ImageDraw.Draw(texture_img)
-                
-                # ポリゴン内部に短い線をランダムに描画してテクスチャを作成
-                import random
-                for _ in range(50):
-                    x1 = random.randint(min(p[0] for p in points), max(p[0] for p in points))
-                    y1 = random.randint(min(p[1] for p in points), max(p[1] for p in points))
-                    x2 = x1 + random.randint(-30, 30)
-                    y2 = y1 + random.randint(-30, 30)
-                    draw_texture.line([(x1, y1), (x2, y2)], fill='black', width=1)
-                
-                # 元の画像とテクスチャをブレンド
-                character_img = Image.blend(character_img, texture_img, 0.3)
-                
-                # 少しぼかして古い象形文字のような効果を追加
-                character_img = character_img.filter(ImageFilter.GaussianBlur(0.5))
-            
-            return character_img
-        else:
+    def get_params(self):
+        """スライダーとスタイルの現在値（メインスレッドで呼ぶこと）"""
+        return dict(
+            canny_threshold1=self.canny_threshold1.get(),
+            canny_threshold2=self.canny_threshold2.get(),
+            contour_simplification=self.contour_simplification.get(),
+            line_thickness=self.line_thickness.get(),
+            style_option=self.style_option.get(),
+            multi_contour=self.multi_contour.get()
+        )
+    
+    def show_preview(self, character, gray):
+        """ライブプレビューの結果を象形文字の欄に表示する（保存される画像は変わらない）"""
+        if gray is None:
+            return
+        preview = Image.fromarray(character if character is not None else gray)
+        self.show_on_output_canvas(preview)
+        self.status_label.config(text="プレビュー表示中（「象形文字に変換」で確定します）")
+    
+    @instrumentation.traced("advanced_version_with_chatgpt")
+    def generate_character_from_image(self, image_path, params):
+        # 同じ画像を同じパラメータで変換済みなら、前回の結果をそのまま使う
+        cache_key = self.result_cache.make_key(self.result_cache.file_hash(image_path), **params)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return Image.fromarray(cached[0])
+        
+        # 輪郭を抽出して象形文字を生成（パラメータ調整可能）
+        # 変わったパラメータより後の段階だけを計算し直す
+        character, features, gray = self.pipeline.run(image_path, **params)
+        
+        if gray is None:
+            return None
+        
+        if character is None:
             # 輪郭が見つからない場合は元の画像をグレースケールで返す
-            pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-            return pil_img
+            return Image.fromarray(gray)
+        
+        self.result_cache.put(cache_key, character, features)
+        return Image.fromarray(character)
     
     def display_output_image(self):
         if self.output_image:
-            # 出力画像をリサイズして表示
-            img = self.resize_image_to_fit(self.output_image, self.output_canvas)
-            
-            self.output_photo = ImageTk.PhotoImage(img)
-            self.output_canvas.config(width=img.width, height=img.height)
-            self.output_canvas.create_image(0, 0, anchor=tk.NW, image=self.output_photo)
+            self.show_on_output_canvas(self.output_image)
+    
+    def show_on_output_canvas(self, image):
+        # 出力画像をリサイズして表示
+        img = self.resize_image_to_fit(image, self.output_canvas)
+        
+        self.output_photo = ImageTk.PhotoImage(img)
+        self.output_canvas.config(width=img.width, height=img.height)
+        self.output_canvas.create_image(0, 0, anchor=tk.NW, image=self.output_photo)
     
     def save_image(self):
         if not self.output_image:
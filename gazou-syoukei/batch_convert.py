@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ディレクトリ内の画像をまとめて象形文字に変換するバッチツール（GUIなし）
+
+使い方:
+    python batch_convert.py 入力ディレクトリ 出力ディレクトリ [--workers N] [--describe]
+
+処理結果は出力ディレクトリの manifest.jsonl に1行ずつ追記され、
+同じコマンドを再実行すると変換済みの画像はスキップされる。
+--describe を付けると、変換した画像の説明文を descriptions.jsonl に書き出す
+（ChatGPT へは複数枚分をまとめて1回のリクエストで頼む）。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from PIL import Image
+
+import engine
+import descriptions
+import instrumentation
+from result_cache import ResultCache
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif")
+MANIFEST_NAME = "manifest.jsonl"
+DESCRIPTIONS_NAME = "descriptions.jsonl"
+
+# ワーカープロセスごとの変換結果キャッシュ（--cache-dir 指定時のみ）
+_result_cache = None
+
+
+def generate_character(image_path, working_size=engine.DEFAULT_WORKING_SIZE):
+    """main.py と同じ設定で象形文字を生成し、(画像, 特徴量) を返す（輪郭がなければ (None, None)）"""
+    if _result_cache is not None:
+        cache_key = _result_cache.make_key(_result_cache.file_hash(image_path), working_size=working_size)
+        cached = _result_cache.get(cache_key)
+        if cached is not None:
+            return Image.fromarray(cached[0]), cached[1]
+
+    # 作業解像度を下回らない範囲で、JPEG のデコード時に縮小して読み込む
+    gray, input_scale = engine.load_gray(image_path, min_side=working_size)
+    if gray is None:
+        raise ValueError(f"画像を読み込めませんでした: {image_path}")
+
+    character, features = engine.generate_character(gray, working_size=working_size, input_scale=input_scale)
+    if character is None:
+        return None, None
+    if _result_cache is not None:
+        _result_cache.put(cache_key, character, features)
+    return Image.fromarray(character), features
+
+
+def find_images(input_dir, exclude_dir=None):
+    """入力ディレクトリ以下の画像ファイルを相対パスで列挙する"""
+    exclude_dir = os.path.abspath(exclude_dir) if exclude_dir else None
+    for dir_path, dir_names, file_names in os.walk(input_dir):
+        # 出力先が入力ディレクトリの中にある場合は生成済みPNGを拾わない
+        dir_names[:] = sorted(d for d in dir_names
+                              if os.path.abspath(os.path.join(dir_path, d)) != exclude_dir)
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dir_path, file_name), input_dir)
+
+
+def file_signature(path):
+    """再開判定用に、ファイルサイズと更新時刻から署名を作る"""
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def load_manifest(manifest_path):
+    """処理済みの画像（相対パス → (署名, 出力先)）を manifest から読み込む（輪郭なしなら出力先は None）"""
+    done = {}
+    if not os.path.exists(manifest_path):
+        return done
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # 途中で中断された最終行は無視する
+                continue
+            if entry.get("status") in ("ok", "no_contour"):
+                done[entry["source"]] = (entry.get("signature"), entry.get("output"))
+            else:
+                done.pop(entry.get("source"), None)
+    return done
+
+
+def convert_one(task):
+    """ワーカープロセスで1枚を変換し、manifest に書く結果を返す"""
+    rel_path, input_path, output_path, signature, working_size = task
+    start = time.perf_counter()
+    result = {"source": rel_path, "signature": signature}
+
+    try:
+        with instrumentation.trace("batch_convert", source=rel_path):
+            character_img, features = generate_character(input_path, working_size)
+            if character_img is not None:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                # 中断されても壊れたPNGが残らないように一時ファイル経由で保存
+                tmp_path = output_path + ".tmp"
+                with instrumentation.span("encode_save"):
+                    character_img.save(tmp_path, format="PNG")
+                    os.replace(tmp_path, output_path)
+        if character_img is None:
+            result["status"] = "no_contour"
+        else:
+            result["status"] = "ok"
+            result["output"] = output_path
+            result["features"] = features
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+
+    result["elapsed"] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def init_worker(cache_dir=None, trace_file=None):
+    global _result_cache
+    # プロセス並列なので OpenCV 内部のスレッドは使わない（コア数以上に膨らむのを防ぐ）
+    cv2.setNumThreads(1)
+    if trace_file:
+        instrumentation.enable(trace_file)
+    if cache_dir:
+        # 同じ画像は1回しか出てこないので、メモリには持たずディスクだけを使う
+        _result_cache = ResultCache(max_entries=0, cache_dir=cache_dir)
+
+
+def output_names(rel_paths):
+    """
+    各画像の出力 PNG の相対パス（入力の拡張子を .png に変える）
+
+    同じディレクトリに拡張子だけが違う画像（a.jpg と a.png など）があると同じ名前になるので、
+    その場合は元の拡張子を残して a.jpg.png / a.png.png とする。大文字・小文字だけの違いも
+    区別しないファイルシステムがあるので、同じ名前として扱う。
+    """
+    stems = {}
+    for rel_path in rel_paths:
+        stem = os.path.splitext(rel_path)[0]
+        stems.setdefault(stem.lower(), []).append(rel_path)
+    names = {}
+    for paths in stems.values():
+        for rel_path in paths:
+            names[rel_path] = (rel_path if len(paths) > 1 else os.path.splitext(rel_path)[0]) + ".png"
+    return names
+
+
+def build_tasks(input_dir, output_dir, done, working_size):
+    tasks = []
+    skipped = 0
+    # 出力名の重複は、処理済みでスキップする画像も含めたすべての画像で調べる
+    rel_paths = list(find_images(input_dir, exclude_dir=output_dir))
+    names = output_names(rel_paths)
+    for rel_path in rel_paths:
+        input_path = os.path.join(input_dir, rel_path)
+        signature = file_signature(input_path)
+        output_path = os.path.join(output_dir, names[rel_path])
+        # 出力名が変わった画像（以前は別の画像と同じ名前に書いていたものなど）は変換し直す
+        previous = done.get(rel_path)
+        if previous is not None and previous[0] == signature and previous[1] in (None, output_path):
+            skipped += 1
+            continue
+        tasks.append((rel_path, input_path, output_path, signature, working_size))
+    return tasks, skipped
+
+
+def run_batch(input_dir, output_dir, workers=None, chunksize=8, working_size=engine.DEFAULT_WORKING_SIZE,
+              cache_dir=None, trace_file=None):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+
+    tasks, skipped = build_tasks(input_dir, output_dir, load_manifest(manifest_path), working_size)
+    workers = workers or os.cpu_count() or 1
+    print(f"対象: {len(tasks)}枚 (処理済みのためスキップ: {skipped}枚), ワーカー数: {workers}")
+
+    counts = {"ok": 0, "no_contour": 0, "error": 0}
+    start = time.perf_counter()
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(cache_dir, trace_file)) as executor:
+        for i, result in enumerate(executor.map(convert_one, tasks, chunksize=chunksize), 1):
+            manifest.write(json.dumps(result, ensure_ascii=False) + "\n")
+            manifest.flush()
+            counts[result["status"]] += 1
+
+            if result["status"] == "error":
+                print(f"[エラー] {result['source']}: {result['error']}")
+            if i % 100 == 0:
+                print(f"{i}/{len(tasks)} 枚完了")
+
+    elapsed = time.perf_counter() - start
+    rate = len(tasks) / elapsed if elapsed > 0 else 0.0
+    print(f"完了: 成功 {counts['ok']}, 輪郭なし {counts['no_contour']}, エラー {counts['error']} "
+          f"({elapsed:.1f}秒, {rate:.1f}枚/秒)")
+    return counts
+
+
+def load_converted(manifest_path):
+    """manifest から、最後に変換に成功した画像の特徴量（相対パス → 特徴量）を読み込む"""
+    converted = {}
+    if not os.path.exists(manifest_path):
+        return converted
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("status") == "ok" and entry.get("features"):
+                converted[entry["source"]] = entry["features"]
+            else:
+                converted.pop(entry.get("source"), None)
+    return converted
+
+
+def load_described(descriptions_path):
+    described = set()
+    if not os.path.exists(descriptions_path):
+        return described
+    with open(descriptions_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                described.add(json.loads(line)["source"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+    return described
+
+
+def describe_converted(output_dir, client=None, batch_size=descriptions.DEFAULT_BATCH_SIZE):
+    """
+    変換済みでまだ説明のない画像の説明文を descriptions.jsonl に追記する
+
+    client が None のときは API を使わずに descriptions.offline_description で作る。
+    """
+    descriptions_path = os.path.join(output_dir, DESCRIPTIONS_NAME)
+    described = load_described(descriptions_path)
+    pending = [(source, features)
+               for source, features in load_converted(os.path.join(output_dir, MANIFEST_NAME)).items()
+               if source not in described]
+    mode = "オフライン" if client is None else f"{batch_size}枚ずつまとめてリクエスト"
+    print(f"説明の生成: {len(pending)}枚 ({mode})")
+
+    counts = {"api": 0, "offline": 0}
+    start = time.perf_counter()
+    with open(descriptions_path, "a", encoding="utf-8") as out:
+        # まとめた単位ごとに書き出すので、中断しても生成済みの説明は残る
+        for chunk_start in range(0, len(pending), batch_size):
+            chunk = pending[chunk_start:chunk_start + batch_size]
+            items = [(os.path.splitext(os.path.basename(source))[0], features) for source, features in chunk]
+            with instrumentation.trace("describe_batch", items=len(items)):
+                results = descriptions.describe_batch(client, items, batch_size=batch_size)
+            for (source, _), (description, mode) in zip(chunk, results):
+                out.write(json.dumps({"source": source, "description": description, "mode": mode},
+                                     ensure_ascii=False) + "\n")
+                counts[mode] += 1
+            out.flush()
+
+    print(f"説明の生成完了: API {counts['api']}, オフライン {counts['offline']} "
+          f"({time.perf_counter() - start:.1f}秒)")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="画像ディレクトリを象形文字PNGに一括変換します")
+    parser.add_argument("input_dir", help="入力画像のディレクトリ（サブディレクトリも対象）")
+    parser.add_argument("output_dir", help="象形文字PNGと manifest.jsonl の出力先")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセス数（既定: CPUコア数）")
+    parser.add_argument("--chunksize", type=int, default=8, help="ワーカーにまとめて渡す枚数")
+    parser.add_argument("--working-size", type=int, default=engine.DEFAULT_WORKING_SIZE,
+                        help="エッジ・輪郭検出を行う長辺のピクセル数（0 で元の解像度のまま）")
+    parser.add_argument("--cache-dir", default=None,
+                        help="変換結果のキャッシュ先。別の出力先に変換し直すときも同じ画像は再計算しない")
+    parser.add_argument("--describe", action="store_true",
+                        help="変換した画像の説明文を descriptions.jsonl に書き出す")
+    parser.add_argument("--describe-batch-size", type=int, default=descriptions.DEFAULT_BATCH_SIZE,
+                        help="ChatGPT に1回のリクエストでまとめて頼む枚数（モデルの出力トークン数の上限を超える分は減らす）")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                        help="OpenAI の APIキー（既定: 環境変数 OPENAI_API_KEY。なければオフラインで説明を作る）")
+    parser.add_argument("--offline", action="store_true",
+                        help="ChatGPT を使わず、輪郭の特徴量からローカルで説明を作る（APIキーがあっても使わない）")
+    parser.add_argument("--trace", default=None, metavar="FILE",
+                        help="段階ごとの処理時間・CPU時間・メモリを JSON Lines で FILE に追記する")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        instrumentation.enable(args.trace)
+    counts = run_batch(args.input_dir, args.output_dir, args.workers, args.chunksize, args.working_size,
+                       args.cache_dir, args.trace)
+    if args.describe:
+        client = None
+        if args.api_key and not args.offline:
+            import openai_client
+            client = openai_client.get_client(api_key=args.api_key)
+        describe_converted(args.output_dir, client, args.describe_batch_size)
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+輪郭処理パイプラインの再現可能なベンチマーク
+
+GUIアプリの generate_character_from_image と同じ流れ（縮小読み込み → 象形文字の生成 → PNG に保存）を、
+合成画像（図形・ノイズ・写真風のグラデーション）と 256px〜8K の画像サイズ、
+Canny の閾値・単純化レベル・スタイルの組み合わせで実行し、
+段階ごとの処理時間（p50 / p95 / p99）・最大メモリ・スループットを表示する。
+段階の内訳は instrumentation.py のトレースで測る。
+
+使い方:
+    python bench_pipeline.py                                   # 標準（256px〜4K）
+    python bench_pipeline.py --full                            # 8K と全パラメータの組み合わせ
+    python bench_pipeline.py --save-baseline bench_baseline.json
+    python bench_pipeline.py --baseline bench_baseline.json    # 基準より遅くなった段階があれば終了コード 1
+
+合成画像は乱数の種を固定して作るので、同じ設定なら毎回同じ入力で計測される。
+基準値はマシンごとに違うので、比較する環境で --save-baseline で作っておくこと。
+"""
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+
+import cv2
+import numpy as np
+
+import engine
+import instrumentation
+from bench_working_resolution import synthesize_photo
+
+# 画像サイズ（名前 → (幅, 高さ)）
+SIZES = {
+    "256": (256, 256),
+    "512": (512, 512),
+    "1K": (1024, 768),
+    "2K": (2048, 1536),
+    "4K": (3840, 2160),
+    "8K": (7680, 4320),
+}
+DEFAULT_SIZES = ("256", "1K", "4K")
+
+IMAGE_KINDS = ("shapes", "noise", "gradient")
+
+# パラメータの組み合わせ（標準 / --full）
+CANNY_THRESHOLDS = ((50, 150),)
+CONTOUR_SIMPLIFICATIONS = (10, 30)
+STYLE_OPTIONS = (engine.STYLE_OUTLINE, engine.STYLE_FILL)
+FULL_CANNY_THRESHOLDS = ((30, 90), (50, 150), (100, 200))
+FULL_CONTOUR_SIMPLIFICATIONS = (1, 10, 30, 50)
+FULL_STYLE_OPTIONS = (engine.STYLE_OUTLINE, engine.STYLE_FILL, engine.STYLE_TEXTURE)
+
+# 比較するのは基準で MIN_COMPARE_MS 以上かかっている段階の p50 とスループットだけ
+# （短すぎる段階や p95 / p99 は、回数が少ないとばらつきが大きい）
+MIN_COMPARE_MS = 2.0
+DEFAULT_TOLERANCE = 0.25
+
+PERCENTILES = (50, 95, 99)
+
+
+# ── 合成画像 ──────────────────────────────────────────
+def synthesize_shapes(width, height, seed=0):
+    """白地に多角形・円・線を描いた図形の画像"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width), 255, np.uint8)
+    side = min(width, height)
+    for _ in range(6):
+        center = rng.uniform((0.2 * width, 0.2 * height), (0.8 * width, 0.8 * height))
+        count = int(rng.integers(3, 9))
+        angles = np.sort(rng.uniform(0, 2 * np.pi, count))
+        radii = side * rng.uniform(0.05, 0.2, count)
+        polygon = np.stack([center[0] + radii * np.cos(angles), center[1] + radii * np.sin(angles)], axis=1)
+        cv2.fillPoly(img, [polygon.astype(np.int32)], int(rng.integers(0, 120)))
+    cv2.circle(img, (width // 2, height // 2), side // 4, 0, max(1, side // 100))
+    cv2.line(img, (0, height - 1), (width - 1, 0), 60, max(1, side // 200))
+    return img
+
+
+def synthesize_noise(width, height, seed=0):
+    """ノイズの多い背景に物体が1つある画像（輪郭が大量に検出される最悪ケース）"""
+    rng = np.random.default_rng(seed)
+    img = rng.normal(128, 40, (height, width)).clip(0, 255).astype(np.uint8)
+    cv2.ellipse(img, (width // 2, height // 2), (width // 4, height // 3), 15, 0, 360, 20, -1)
+    return img
+
+
+SYNTHESIZERS = {
+    "shapes": synthesize_shapes,
+    "noise": synthesize_noise,
+    "gradient": synthesize_photo,
+}
+
+
+def encode_input(kind, gray):
+    """読み込みの段階も測るため、写真風の画像は JPEG、図形は PNG にしておく"""
+    ext, params = (".png", []) if kind == "shapes" else (".jpg", [cv2.IMWRITE_JPEG_QUALITY, 90])
+    ok, data = cv2.imencode(ext, gray, params)
+    if not ok:
+        raise RuntimeError(f"合成画像をエンコードできませんでした: {kind}")
+    return data.tobytes()
+
+
+# ── 計測 ──────────────────────────────────────────────
+def run_once(data, canny, simplification, style, working_size):
+    """1回分の変換（generate_character_from_image と同じ流れ）。トレースを返す"""
+    with instrumentation.trace("bench", always=True) as trace:
+        gray, input_scale = engine.decode_gray(data)
+        character, _ = engine.generate_character(
+            gray, canny[0], canny[1], simplification, style_option=style,
+            working_size=working_size, input_scale=input_scale)
+        if character is not None:
+            with instrumentation.span("encode"):
+                cv2.imencode(".png", character)
+    return trace
+
+
+def percentiles(values):
+    values = np.asarray(values)
+    return {f"p{p}": round(float(np.percentile(values, p)), 3) for p in PERCENTILES}
+
+
+def bench_size(size_name, kinds, grid, repeat, working_size, seed):
+    width, height = SIZES[size_name]
+    totals = []
+    stages = {}
+    no_contour = 0
+    for kind in kinds:
+        data = encode_input(kind, SYNTHESIZERS[kind](width, height, seed))
+        # 最初の1回は計測しない（OpenCV の初期化などを除くため）
+        run_once(data, *grid[0], working_size)
+        for canny, simplification, style in grid:
+            for _ in range(repeat):
+                trace = run_once(data, canny, simplification, style, working_size)
+                totals.append(trace.wall_ms)
+                for stage in trace.stages:
+                    stages.setdefault(stage["stage"], []).append(stage["wall_ms"])
+                if not any(stage["stage"] == "encode" for stage in trace.stages):
+                    no_contour += 1
+
+    total_seconds = sum(totals) / 1000
+    peak = instrumentation.peak_rss_kb()
+    return {
+        "width": width,
+        "height": height,
+        "runs": len(totals),
+        "throughput": round(len(totals) / total_seconds, 2) if total_seconds else None,
+        "peak_rss_mb": round(peak / 1024, 1) if peak is not None else None,
+        "no_contour": no_contour,
+        "total": percentiles(totals),
+        "stages": {name: percentiles(values) for name, values in stages.items()},
+    }
+
+
+def build_grid(full):
+    if full:
+        return list(itertools.product(FULL_CANNY_THRESHOLDS, FULL_CONTOUR_SIMPLIFICATIONS, FULL_STYLE_OPTIONS))
+    return list(itertools.product(CANNY_THRESHOLDS, CONTOUR_SIMPLIFICATIONS, STYLE_OPTIONS))
+
+
+def print_size(size_name, result):
+    print(f"\n[{size_name}] {result['width']}x{result['height']}  {result['runs']}回, "
+          f"{result['throughput']}枚/秒, 最大メモリ {result['peak_rss_mb']}MB"
+          + (f", 輪郭なし {result['no_contour']}" if result["no_contour"] else ""))
+    print(f"  {'段階':<16}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}")
+    rows = list(result["stages"].items()) + [("合計", result["total"])]
+    for name, p in rows:
+        print(f"  {name:<16}{p['p50']:>10.2f}{p['p95']:>10.2f}{p['p99']:>10.2f}")
+
+
+# ── 基準との比較 ──────────────────────────────────────
+def compare(results, baseline, tolerance):
+    """基準より tolerance を超えて遅くなった値のリストを返す"""
+    if baseline.get("config") != results["config"]:
+        raise ValueError("基準ファイルと計測の設定（サイズ・画像・パラメータ・回数）が違うため比較できません")
+
+    regressions = []
+    for size_name, current in results["sizes"].items():
+        base = baseline["sizes"].get(size_name)
+        if base is None:
+            continue
+        pairs = [("合計", base["total"], current["total"])]
+        pairs += [(stage, p, current["stages"].get(stage)) for stage, p in base["stages"].items()]
+        for name, base_p, current_p in pairs:
+            if current_p is None or base_p["p50"] < MIN_COMPARE_MS:
+                continue
+            ratio = current_p["p50"] / base_p["p50"]
+            if ratio > 1 + tolerance:
+                regressions.append(f"[{size_name}] {name} p50: {base_p['p50']:.2f}ms → "
+                                   f"{current_p['p50']:.2f}ms ({ratio:.2f}倍)")
+        if base["total"]["p50"] >= MIN_COMPARE_MS and current["throughput"] < base["throughput"] / (1 + tolerance):
+            regressions.append(f"[{size_name}] スループット: {base['throughput']}枚/秒 → "
+                               f"{current['throughput']}枚/秒")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="輪郭処理パイプラインの段階ごとの処理時間を計測します")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=None,
+                        help=f"計測する画像サイズ（既定: {' '.join(DEFAULT_SIZES)}、--full なら全サイズ）")
+    parser.add_argument("--kinds", nargs="+", choices=IMAGE_KINDS, default=list(IMAGE_KINDS),
+                        help="合成画像の種類")
+    parser.add_argument("--full", action="store_true", help="8K までの全サイズとパラメータの全組み合わせで計測する")
+    parser.add_argument("--repeat", type=int, default=5, help="組み合わせごとの繰り返し回数")
+    parser.add_argument("--working-size", type=int, default=0,
+                        help="エッジ・輪郭検出の作業解像度（既定: 0 = GUIアプリと同じく元の解像度）")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="OpenCV のスレッド数（既定: 1。ばらつきを減らすため）")
+    parser.add_argument("--seed", type=int, default=0, help="合成画像の乱数の種")
+    parser.add_argument("--output", default=None, help="結果を JSON で保存する")
+    parser.add_argument("--save-baseline", default=None, metavar="FILE", help="結果を基準として保存する")
+    parser.add_argument("--baseline", default=None, metavar="FILE",
+                        help="基準と比較し、遅くなった段階があれば終了コード 1 で終わる")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="許容する遅れの割合（既定: 0.25 = 25%%）")
+    args = parser.parse_args(argv)
+
+    cv2.setNumThreads(args.threads)
+    sizes = args.sizes or (list(SIZES) if args.full else list(DEFAULT_SIZES))
+    grid = build_grid(args.full)
+    working_size = args.working_size or None
+
+    config = {
+        "sizes": sizes,
+        "kinds": args.kinds,
+        "grid": [[list(canny), simplification, style] for canny, simplification, style in grid],
+        "repeat": args.repeat,
+        "working_size": working_size,
+        "threads": args.threads,
+        "seed": args.seed,
+    }
+    print(f"画像 {len(args.kinds)}種類 × サイズ {len(sizes)} × パラメータ {len(grid)}通り × {args.repeat}回 "
+          f"(OpenCV {cv2.__version__}, スレッド数 {args.threads})")
+
+    results = {
+        "config": config,
+        "environment": {"python": platform.python_version(), "opencv": cv2.__version__,
+                        "numpy": np.__version__, "machine": platform.machine(), "time": time.time()},
+        "sizes": {},
+    }
+    # メモリの最大値は小さい画像から順に測る（プロセス全体の最大値なので、大きい画像の分が後から増える）
+    for size_name in sorted(sizes, key=lambda name: SIZES[name][0] * SIZES[name][1]):
+        results["sizes"][size_name] = bench_size(size_name, args.kinds, grid, args.repeat, working_size, args.seed)
+        print_size(size_name, results["sizes"][size_name])
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f"\n結果を保存しました: {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        try:
+            regressions = compare(results, baseline, args.tolerance)
+        except ValueError as e:
+            print(f"\n[エラー] {e}")
+            return 2
+        if regressions:
+            print(f"\n基準より {args.tolerance:.0%} 以上遅くなりました:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"\n基準との比較: 問題なし（許容 {args.tolerance:.0%}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+作業解像度（縮小してからCanny）の効果を測るベンチマーク
+
+元の解像度のまま処理した場合と、長辺を --working-size に縮小して処理した場合の
+処理時間と、出力される象形文字の一致度を比較する。
+
+使い方:
+    python bench_working_resolution.py                  # 合成画像（12MP / 48MP）で計測
+    python bench_working_resolution.py photo1.jpg ...   # 手元の画像で計測
+"""
+import sys
+import time
+import argparse
+import statistics
+
+import cv2
+import numpy as np
+
+import engine
+
+
+def synthesize_photo(width, height, seed=0):
+    """グラデーション背景・ノイズ・物体を含む写真風の合成画像を作る"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    background = 90 + 80 * (x / width) + 40 * np.sin(y / height * np.pi)
+    img = background + rng.normal(0, 6, (height, width)).astype(np.float32)
+
+    # 中央に不規則な形の物体を置く
+    angles = np.linspace(0, 2 * np.pi, 64, endpoint=False)
+    radii = min(width, height) * (0.3 + 0.06 * rng.standard_normal(64))
+    polygon = np.stack([width / 2 + radii * np.cos(angles), height / 2 + radii * np.sin(angles)], axis=1)
+    canvas = np.clip(img, 0, 255).astype(np.uint8)
+    cv2.fillPoly(canvas, [polygon.astype(np.int32)], 30)
+    cv2.circle(canvas, (int(width * 0.45), int(height * 0.45)), min(width, height) // 20, 220, -1)
+    return canvas
+
+
+def ink_similarity(a, b, tolerance=3):
+    """2つの象形文字の線の一致度（IoU）。数ピクセルのずれは許容する"""
+    ink_a = a < 128
+    ink_b = b < 128
+    kernel = np.ones((2 * tolerance + 1, 2 * tolerance + 1), np.uint8)
+    near_a = cv2.dilate(ink_a.astype(np.uint8), kernel) > 0
+    near_b = cv2.dilate(ink_b.astype(np.uint8), kernel) > 0
+    matched = (ink_a & near_b).sum() + (ink_b & near_a).sum()
+    total = ink_a.sum() + ink_b.sum()
+    return matched / total if total else 1.0
+
+
+def measure(gray, working_size, repeat):
+    times = []
+    character = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        character, _ = engine.generate_character(gray, working_size=working_size)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), character
+
+
+def run(images, working_size, repeat):
+    print(f"{'画像':<24}{'元解像度(ms)':>14}{'縮小(ms)':>12}{'高速化':>8}{'一致度':>8}")
+    for name, gray in images:
+        full_time, full_character = measure(gray, None, repeat)
+        fast_time, fast_character = measure(gray, working_size, repeat)
+
+        if full_character is None or fast_character is None:
+            similarity = "-"
+        else:
+            similarity = f"{ink_similarity(full_character, fast_character):.3f}"
+        print(f"{name:<24}{full_time * 1000:>14.1f}{fast_time * 1000:>12.1f}"
+              f"{full_time / fast_time:>7.1f}x{similarity:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="作業解像度による高速化と出力の一致度を計測します")
+    parser.add_argument("images", nargs="*", help="計測に使う画像（省略時は合成画像）")
+    parser.add_argument("--working-size", type=int, default=engine.DEFAULT_WORKING_SIZE)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.images:
+        images = []
+        for path in args.images:
+            gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                print(f"画像を読み込めませんでした: {path}")
+                return 1
+            images.append((path[-24:], gray))
+    else:
+        images = [("合成 4000x3000 (12MP)", synthesize_photo(4000, 3000)),
+                  ("合成 8000x6000 (48MP)", synthesize_photo(8000, 6000, seed=1))]
+
+    run(images, args.working_size, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+象形文字の説明文の生成
+
+fixed_main.py と同じ内容のプロンプトで ChatGPT に説明を作らせる。
+batch_convert.py のように多数の画像を扱う場合は、describe_batch() が
+batch_size 枚分の特徴量を1回のリクエストにまとめ、JSON で返ってきた説明を
+画像ごとに振り分ける。API が使えない・応答に含まれていない画像には、
+ローカルのルール（offline_description）で説明を作る。
+
+offline_description は輪郭の特徴量（点の数・凸かどうか・縦横比・面積の比率）から
+決定的に説明文を組み立てるので、API のキーや通信なしに一瞬で同じ結果が得られる。
+"""
+import json
+import zlib
+
+SYSTEM_MESSAGE = "あなたは古代文字の専門家です。象形文字の特徴から、その意味や用途を説明してください。"
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_BATCH_SIZE = 20
+
+# まとめて頼むリクエスト1回の制限時間（秒）。超えたらその分はオフラインの説明にする
+BATCH_DEADLINE = 120
+
+# 1枚あたりの説明に必要なトークン数の目安（100文字程度の日本語）
+_TOKENS_PER_ITEM = 200
+
+# モデルごとの応答（出力）トークン数の上限。1回にまとめる枚数はこれに収まるように減らす
+MAX_OUTPUT_TOKENS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4o": 16384,
+    "gpt-4o-mini": 16384,
+}
+_DEFAULT_MAX_OUTPUT_TOKENS = 4096
+
+
+def max_batch_size(model=DEFAULT_MODEL):
+    """1回のリクエストにまとめられる枚数（応答が model の出力トークン数の上限に収まる数）"""
+    return max(1, MAX_OUTPUT_TOKENS.get(model, _DEFAULT_MAX_OUTPUT_TOKENS) // _TOKENS_PER_ITEM)
+
+
+def feature_lines(image_name, features):
+    """プロンプトに入れる画像名と輪郭の特徴量の箇条書き"""
+    lines = [f"- 画像名: {image_name}"]
+    if features:
+        lines += [
+            f"- 点の数: {features['points_count']}",
+            f"- 閉じた形状: {'はい' if features['is_closed'] else 'いいえ'}",
+            f"- 面積: {features['area']:.2f}",
+            f"- 周囲長: {features['perimeter']:.2f}",
+            f"- 凸形状: {'はい' if features['is_convex'] else 'いいえ'}",
+        ]
+    return lines
+
+
+def build_prompt(image_name, features=None):
+    """1枚分の説明を頼むプロンプト（features が None なら画像名だけで頼む）"""
+    if features:
+        head = "以下の特徴を持つ輪郭から生成された象形文字について、古代文字のような説明を100文字程度で作成してください。"
+    else:
+        head = f"「{image_name}」という名前の画像から生成された象形文字について、古代文字のような説明を100文字程度で作成してください。"
+    return "\n".join([head, "説明は「この象形文字は...」で始めてください。", ""] + feature_lines(image_name, features))
+
+
+def build_batch_prompt(items):
+    """複数枚分の説明をまとめて頼むプロンプト。items は (画像名, 特徴量) のリスト"""
+    lines = [
+        "以下の各象形文字について、輪郭の特徴から古代文字のような説明をそれぞれ100文字程度で作成してください。",
+        "各説明は「この象形文字は...」で始めてください。",
+        '結果は {"descriptions": [{"id": 番号, "description": "説明"}, ...]} という JSON だけで返してください。',
+        "",
+    ]
+    for i, (image_name, features) in enumerate(items):
+        lines.append(f"[{i}]")
+        lines += feature_lines(image_name, features)
+    return "\n".join(lines)
+
+
+# ── オフラインの説明文 ──────────────────────────────────
+_OPENINGS = (
+    "この象形文字は{name}を表しています。",
+    "この象形文字は{name}の姿をかたどったものです。",
+    "この象形文字は、{name}を写し取って生まれた文字です。",
+)
+
+_MEANINGS = {
+    "convex": (
+        "古代の人々はこの形で{name}の安定や豊かさを表しました。",
+        "欠けたところのない形から、{name}のように満ち足りたものを示す印として使われたと考えられます。",
+        "祭礼の記録では、{name}を数えるときの印としてこの形が刻まれていました。",
+    ),
+    "concave": (
+        "入り組んだ形は、{name}の動きや変化を伝えています。",
+        "古代の人々はこの形で{name}の力強さや生命力を表現しました。",
+        "くぼみのある形から、{name}が何かを包み込む様子を表したと考えられます。",
+    ),
+}
+
+_ASPECTS = {
+    "wide": "横に長く伸びた",
+    "tall": "縦にすらりと伸びた",
+    "square": "縦横の釣り合いがとれた",
+}
+
+
+def _shape_phrase(points_count, is_convex):
+    if points_count <= 3:
+        return "三角形に近い形"
+    if points_count == 4:
+        return "四角形に近い形"
+    if points_count <= 8:
+        return f"{points_count}つの角を持つ多角形"
+    return "丸みを帯びたなめらかな形" if is_convex else "細かく入り組んだ形"
+
+
+def _detail_phrase(features):
+    solidity = features.get("solidity")
+    extent = features.get("extent")
+    if solidity is not None and solidity < 0.7:
+        return "大きなくぼみが特徴です。"
+    if extent is not None and extent >= 0.85:
+        return "輪郭が枠いっぱいに広がっています。"
+    if extent is not None and extent < 0.45:
+        return "細い線で軽やかに描かれています。"
+    return "輪郭は力強くまとまっています。"
+
+
+def offline_description(image_name, features=None):
+    """
+    API を使わずに、輪郭の特徴量から説明文を組み立てる
+
+    同じ画像名と特徴量からは必ず同じ説明が返る。features が None（輪郭なし）なら画像名だけで作る。
+    """
+    seed = zlib.crc32(f"{image_name}|{features and features.get('points_count')}|"
+                      f"{features and round(features.get('area', 0))}".encode("utf-8"))
+    opening = _OPENINGS[seed % len(_OPENINGS)].format(name=image_name)
+    if not features:
+        return opening + "古代の人々はこの形を使って重要な概念を表現していました。"
+
+    aspect_ratio = features.get("aspect_ratio", 1.0)
+    if aspect_ratio >= 1.6:
+        aspect = _ASPECTS["wide"]
+    elif aspect_ratio <= 1 / 1.6:
+        aspect = _ASPECTS["tall"]
+    else:
+        aspect = _ASPECTS["square"]
+
+    image_ratio = features.get("image_ratio")
+    if image_ratio is not None and image_ratio >= 0.4:
+        size = "画面の大部分を占める、"
+    elif image_ratio is not None and image_ratio <= 0.05:
+        size = "小さくまとまった、"
+    else:
+        size = ""
+
+    shape = _shape_phrase(features["points_count"], features["is_convex"])
+    meanings = _MEANINGS["convex" if features["is_convex"] else "concave"]
+    meaning = meanings[(seed // len(_OPENINGS)) % len(meanings)].format(name=image_name)
+    return f"{opening}{size}{aspect}{shape}で、{_detail_phrase(features)}{meaning}"
+
+
+def parse_batch_response(content, count):
+    """まとめて頼んだ応答から、番号順の説明のリストを作る（見つからない番号は None）"""
+    results = [None] * count
+    obj = json.loads(content)
+    entries = obj.get("descriptions", []) if isinstance(obj, dict) else obj
+    for entry in entries:
+        try:
+            index = int(entry["id"])
+            description = str(entry["description"]).strip()
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < count and description:
+            results[index] = description
+    return results
+
+
+def describe_batch(client, items, model=DEFAULT_MODEL, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    items（(画像名, 特徴量) のリスト）の説明を batch_size 件ずつまとめて生成する
+
+    戻り値は items と同じ順の (説明, "api" または "offline") のリスト。
+    client が None のときはすべて offline_description で作る。
+    batch_size が大きすぎて応答がモデルの出力トークン数の上限を超える場合は、max_batch_size(model) 件ずつにする。
+    """
+    limit = max_batch_size(model)
+    if client is not None and batch_size > limit:
+        print(f"{model} の出力トークン数の上限に合わせて、{batch_size}件ではなく{limit}件ずつまとめて生成します")
+        batch_size = limit
+    results = []
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        descriptions = [None] * len(chunk)
+        if client is not None:
+            try:
+                response = client.chat_completion(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_MESSAGE},
+                        {"role": "user", "content": build_batch_prompt(chunk)}
+                    ],
+                    max_tokens=_TOKENS_PER_ITEM * len(chunk),
+                    temperature=0.7,
+                    response_format={"type": "json_object"},
+                    deadline=BATCH_DEADLINE
+                )
+                descriptions = parse_batch_response(response.choices[0].message.content, len(chunk))
+            except Exception as e:
+                print(f"説明のまとめて生成に失敗しました（{start + 1}〜{start + len(chunk)}件目はオフラインの説明を使用します）: {str(e)}")
+            else:
+                missing = descriptions.count(None)
+                if missing:
+                    print(f"応答に説明がなかった{missing}件はオフラインの説明を使用します（{start + 1}〜{start + len(chunk)}件目）")
+
+        for (image_name, features), description in zip(chunk, descriptions):
+            if description is None:
+                results.append((offline_description(image_name, features), "offline"))
+            else:
+                results.append((description, "api"))
+        if progress is not None:
+            progress(f"説明を生成中... {len(results)}/{len(items)}")
+    return results
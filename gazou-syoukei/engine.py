@@ -0,0 +1,673 @@
+# -*- coding: utf-8 -*-
+"""
+画像から象形文字を生成する処理の本体
+
+Tkinter や OpenAI には依存しないので、GUIアプリ・Flaskアプリ・バッチ処理の
+どこからでも import できる。入力は OpenCV の画像配列、出力は象形文字の画像配列と
+輪郭の特徴量。描画も NumPy / OpenCV だけで行うので Pillow も必要ない。
+各段階（読み込み・グレースケール化・Canny・輪郭検出・単純化・描画）は
+instrumentation.timed で計測できる（TRACE=1 のときだけ記録される）。
+"""
+import io
+import os
+
+import cv2
+import numpy as np
+
+import instrumentation
+
+# 象形文字や特徴量の結果が変わる変更をしたら上げる（result_cache のキーに入る）
+ENGINE_VERSION = 2
+
+CANVAS_SIZE = (500, 500)
+
+# エッジ・輪郭検出を行う作業解像度（長辺のピクセル数）の推奨値
+DEFAULT_WORKING_SIZE = 1024
+
+# 複数輪郭モードで残す外側の輪郭の数と、最大の輪郭に対する面積の下限（割合）
+MULTI_CONTOUR_TOP_K = 8
+MULTI_CONTOUR_MIN_RATIO = 0.02
+# 画像全体に対する面積の下限（500x500 の出力で 11px 四方に満たない輪郭は見えないので使わない）
+MULTI_CONTOUR_MIN_IMAGE_RATIO = 0.0005
+
+# スタイルオプション（advanced_version.py のラジオボタンと同じ値）
+STYLE_OUTLINE = 0   # 輪郭のみ
+STYLE_FILL = 1      # 塗りつぶし
+STYLE_TEXTURE = 2   # テクスチャ付き
+
+
+# 縮小しながらグレースケールで読み込むフラグ（縮小率の大きい順）
+_REDUCED_GRAYSCALE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+# カラーで縮小しながら読み込むフラグ（画像認識 API に送る画像用）
+_REDUCED_COLOR_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def _notify(progress, message):
+    if progress is not None:
+        progress(message)
+
+
+# メモリ上の画像のサイズを調べるときに見る先頭部分（JPEG の EXIF サムネイルも含めて十分な大きさ）
+_HEADER_BYTES = 256 * 1024
+
+
+def _peek_size(source):
+    """画像全体をデコードせずに、ヘッダーから (幅, 高さ) を取得する"""
+    try:
+        from PIL import Image
+        with Image.open(source) as header:
+            return header.size
+    except Exception:
+        return None
+
+
+def _peek_buffer_size(data):
+    """bytes や mmap の先頭だけを見てサイズを取得する（全体はコピーしない）"""
+    return _peek_size(io.BytesIO(memoryview(data)[:_HEADER_BYTES].tobytes()))
+
+
+def choose_decode_flag(image_size, min_side=max(CANVAS_SIZE), color=False):
+    """
+    長辺が min_side を下回らない範囲で、できるだけ小さく読み込むフラグを選ぶ
+
+    戻り値は (imread のフラグ, 縮小率)。JPEG はデコード時に縮小されるので、
+    大きな写真ほど読み込み時間とメモリが減る。color=True ならカラーで読み込むフラグを返す。
+    """
+    if image_size and min_side:
+        longest = max(image_size)
+        for factor, flag in (_REDUCED_COLOR_FLAGS if color else _REDUCED_GRAYSCALE_FLAGS):
+            if longest // factor >= min_side:
+                return flag, 1.0 / factor
+    return (cv2.IMREAD_COLOR if color else cv2.IMREAD_GRAYSCALE), 1.0
+
+
+@instrumentation.timed("decode")
+def load_gray(image_path, min_side=max(CANVAS_SIZE)):
+    """画像ファイルをグレースケールで縮小読み込みし、(画像, 縮小率) を返す（失敗時は (None, 1.0)）"""
+    flag, scale = choose_decode_flag(_peek_size(image_path), min_side)
+    gray = cv2.imread(image_path, flag)
+    if gray is None:
+        return None, 1.0
+    return gray, scale
+
+
+@instrumentation.timed("decode")
+def decode_gray(data, min_side=max(CANVAS_SIZE)):
+    """メモリ上の画像データ（bytes や mmap）を load_gray と同じように読み込む"""
+    flag, scale = choose_decode_flag(_peek_buffer_size(data), min_side)
+    gray = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if gray is None:
+        return None, 1.0
+    return gray, scale
+
+
+@instrumentation.timed("decode")
+def decode_color(data, min_side=max(CANVAS_SIZE)):
+    """メモリ上の画像データ（bytes や mmap）をカラー（BGR）で縮小読み込みし、(画像, 縮小率) を返す"""
+    flag, scale = choose_decode_flag(_peek_buffer_size(data), min_side, color=True)
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if img is None:
+        return None, 1.0
+    return img, scale
+
+
+@instrumentation.timed("grayscale")
+def to_gray(img):
+    """カラー画像ならグレースケールに変換する（既にグレースケールならそのまま）"""
+    if img.ndim == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+@instrumentation.timed("resize")
+def downscale(gray, max_side):
+    """長辺が max_side を超える場合は面積平均で縮小し、(縮小画像, 縮小率) を返す"""
+    h, w = gray.shape[:2]
+    longest = max(h, w)
+    if not max_side or longest <= max_side:
+        return gray, 1.0
+
+    scale = max_side / longest
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA), scale
+
+
+def rescale_contour(contour, scale):
+    """縮小画像上の輪郭を元画像の座標に戻す"""
+    if scale == 1.0:
+        return contour
+    return np.rint(contour / scale).astype(np.int32)
+
+
+def rescale_stats(stats, scale):
+    """縮小画像上の輪郭の contour_stats の結果を元画像の単位に戻す（rescale_contour に合わせる）"""
+    if scale == 1.0:
+        return stats
+    stats = stats.copy()
+    stats["area"] /= scale * scale
+    stats["perimeter"] /= scale
+    for name in ("x", "y", "w", "h"):
+        stats[name] = np.rint(stats[name] / scale)
+    return stats
+
+
+@instrumentation.timed("canny")
+def detect_edges(gray, threshold1=50, threshold2=150):
+    return cv2.Canny(gray, threshold1, threshold2)
+
+
+# エッジの画素がこの割合を超える画像では、輪郭を検出する前に小さな連結成分を消す
+_DENSE_EDGE_RATIO = 0.1
+
+# 親とほぼ同じ面積の子輪郭は、エッジの線の内側をなぞったもの（穴ではない）とみなす
+_STROKE_INNER_RATIO = 0.8
+
+
+def drop_small_components(binary, min_area):
+    """
+    外接矩形の面積が min_area 以下の連結成分を消した二値画像を返す
+
+    輪郭の面積は連結成分の外接矩形より大きくならないので、面積が min_area より大きい輪郭は消えない。
+    ノイズの多い画像では輪郭が数十万個になり、findContours とその後の処理が遅くなるので、
+    エッジが多い（画素の _DENSE_EDGE_RATIO を超える）ときだけ先に消す。それ以外はそのまま返す。
+    """
+    if min_area <= 0 or cv2.countNonZero(binary) <= binary.size * _DENSE_EDGE_RATIO:
+        return binary
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    keep = stats[:, cv2.CC_STAT_WIDTH].astype(np.int64) * stats[:, cv2.CC_STAT_HEIGHT] > min_area
+    keep[0] = False
+    return (keep.astype(np.uint8) * 255)[labels]
+
+
+@instrumentation.timed("find_contours")
+def find_contours(binary, mode=cv2.RETR_EXTERNAL, min_area=0):
+    """輪郭を検出する。min_area を指定すると、面積がそれ以下にしかならない小さな連結成分は先に除く"""
+    contours, _ = cv2.findContours(drop_small_components(binary, min_area), mode, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+
+# contour_stats が返す構造化配列の型
+# （index は元の輪郭のリストでの添字、外接矩形は cv2.boundingRect と同じ x, y, 幅, 高さ）
+CONTOUR_STATS_DTYPE = np.dtype([
+    ("index", np.intp),
+    ("area", np.float64),
+    ("perimeter", np.float64),
+    ("x", np.int32),
+    ("y", np.int32),
+    ("w", np.int32),
+    ("h", np.int32),
+])
+
+
+def contour_stats(contours, min_area=None, limit=None):
+    """
+    輪郭ごとの面積・周囲長・外接矩形を1回だけ求め、CONTOUR_STATS_DTYPE の構造化配列で返す
+
+    輪郭の絞り込み・最大の輪郭の選択・特徴量の計算で同じ値を使い回すためのもの。
+    min_area を指定すると面積がそれより大きい輪郭だけを、limit を指定すると面積の大きい順に
+    limit 個（同じ面積なら先の輪郭）だけを返し、周囲長と外接矩形もその輪郭だけで求める
+    （ノイズの多い画像では RETR_LIST で数万個の輪郭が出るが、使うのはそのごく一部）。
+    """
+    areas = np.fromiter(map(cv2.contourArea, contours), np.float64, len(contours))
+    index = np.arange(len(contours)) if min_area is None else np.flatnonzero(areas > min_area)
+    if limit is not None and len(index) > limit:
+        kth = np.partition(areas[index], len(index) - limit)[len(index) - limit]
+        index = index[areas[index] >= kth]
+        index = index[np.argsort(-areas[index], kind="stable")[:limit]]
+    stats = np.zeros(len(index), CONTOUR_STATS_DTYPE)
+    stats["index"] = index
+    stats["area"] = areas[index]
+    if len(index):
+        selected = [contours[i] for i in index]
+        stats["perimeter"] = [cv2.arcLength(contour, True) for contour in selected]
+        stats["x"], stats["y"], stats["w"], stats["h"] = np.array(list(map(cv2.boundingRect, selected))).T
+    return stats
+
+
+@instrumentation.timed("select_contour")
+def select_main_contour(contours, min_area=0, stats=None):
+    """
+    面積が min_area より大きい輪郭のうち、最も大きいものを返す（なければ None）
+
+    stats には contour_stats の結果を渡せる（省略すると計算する）。
+    """
+    if stats is None:
+        stats = contour_stats(contours, limit=1)
+    stats = stats[stats["area"] > min_area]
+    if len(stats) == 0:
+        # 面積のある輪郭がなければ（直線だけなど）、min_area がないときはこれまでどおり最初の輪郭を使う
+        return contours[0] if min_area <= 0 and len(contours) else None
+    return contours[stats["index"][np.argmax(stats["area"])]]
+
+
+@instrumentation.timed("find_contours")
+def find_contour_tree(binary, min_area=0):
+    """
+    RETR_TREE で輪郭を検出し、(輪郭, 各輪郭の親の添字（なければ -1）) を返す
+
+    RETR_TREE は輪郭の数が多いと非常に遅い（ノイズの多い 4K 画像で数秒）ので、
+    drop_small_components で min_area に届かない連結成分を先に消してから調べる。
+    """
+    binary = drop_small_components(binary, min_area)
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    parents = hierarchy[0, :, 3] if hierarchy is not None else np.zeros(0, np.intp)
+    return contours, parents
+
+
+@instrumentation.timed("select_contour")
+def select_contours(contours, parents, top_k=MULTI_CONTOUR_TOP_K, min_ratio=MULTI_CONTOUR_MIN_RATIO, min_area=0):
+    """
+    輪郭の階層から、象形文字に使う外側の輪郭と穴を選ぶ
+
+    面積が min_area より大きく、最大の輪郭の min_ratio 倍以上の輪郭だけを対象にする
+    （面積は contour_stats で1回だけ計算し、小さな輪郭は階層をたどる前に除く）。
+    外側の輪郭は面積の大きい順に top_k 個まで、穴は選んだ輪郭の中にあるものだけを残す。
+    戻り値は (外側の輪郭の添字のリスト, 穴の添字のリスト)。どちらも面積の大きい順。
+    """
+    stats = contour_stats(contours, min_area)
+    if len(stats) == 0:
+        return [], []
+    stats = stats[stats["area"] > stats["area"].max() * min_ratio]
+    # 外側の輪郭は中の輪郭より面積が大きいので、大きい順に見れば親は必ず先に決まっている
+    stats = stats[np.argsort(-stats["area"], kind="stable")]
+    order = stats["index"].tolist()
+    areas = dict(zip(order, stats["area"].tolist()))
+    candidate_set = set(order)
+
+    depth = {}
+    effective_parent = {}
+    stroke_inner = set()
+    for i in order:
+        parent = int(parents[i])
+        while parent != -1 and parent not in candidate_set:
+            parent = int(parents[parent])
+        if parent != -1 and parent not in stroke_inner and areas[i] >= _STROKE_INNER_RATIO * areas[parent]:
+            # エッジの線の内側。この中の輪郭は、線の外側の輪郭の子として扱う
+            stroke_inner.add(i)
+            effective_parent[i] = parent
+            continue
+        if parent in stroke_inner:
+            parent = effective_parent[parent]
+        effective_parent[i] = parent
+        depth[i] = 0 if parent == -1 else depth.get(parent, 0) + 1
+
+    outers, holes = [], []
+    kept = set()
+    for i in order:
+        if i in stroke_inner:
+            continue
+        parent = effective_parent[i]
+        if parent != -1 and parent not in kept:
+            continue
+        if depth[i] % 2 == 0:
+            if len(outers) >= top_k:
+                continue
+            outers.append(i)
+        else:
+            holes.append(i)
+        kept.add(i)
+    return outers, holes
+
+
+@instrumentation.timed("approx_poly")
+def simplify_contour(contour, contour_simplification=10, perimeter=None):
+    """
+    輪郭を単純化する（contour_simplification は周囲長に対する千分率）
+
+    perimeter には輪郭の選択で求めた周囲長を渡せる（省略すると計算する）。
+    """
+    if perimeter is None:
+        perimeter = cv2.arcLength(contour, True)
+    epsilon = (contour_simplification / 1000) * float(perimeter)
+    return cv2.approxPolyDP(contour, epsilon, True)
+
+
+@instrumentation.timed("approx_poly")
+def simplify_contours(contours, contour_simplification=10, stats=None):
+    """
+    複数の輪郭を単純化する（周囲長は contour_stats でまとめて求め、輪郭ごとの許容誤差を決める）
+
+    stats には contours と同じ順の contour_stats の結果を渡せる（省略すると計算する）。
+    """
+    if stats is None:
+        stats = contour_stats(contours)
+    epsilons = (contour_simplification / 1000) * stats["perimeter"]
+    return [cv2.approxPolyDP(contour, float(epsilon), True) for contour, epsilon in zip(contours, epsilons)]
+
+
+def extract_features(main_contour, approx_contour, image_shape=None, stats=None):
+    """
+    説明文の生成に使う輪郭の特徴量
+
+    縦横比と面積の比率（外接矩形・凸包・画像全体に対する輪郭の面積）は、
+    画像の縮小率に関係なく同じ値になる。image_shape がなければ画像に対する比率は None。
+    stats には main_contour の contour_stats の行を渡せる（省略すると計算する）。
+    """
+    if stats is None:
+        stats = contour_stats([main_contour])[0]
+    area = float(stats["area"])
+    w, h = int(stats["w"]), int(stats["h"])
+    hull_area = float(cv2.contourArea(cv2.convexHull(main_contour)))
+    image_area = float(image_shape[0] * image_shape[1]) if image_shape is not None else 0.0
+    return {
+        "points_count": len(approx_contour),
+        "is_closed": True,
+        "area": area,
+        "perimeter": float(stats["perimeter"]),
+        "is_convex": bool(cv2.isContourConvex(approx_contour)),
+        "aspect_ratio": w / h if h else 1.0,
+        "extent": area / (w * h) if w * h else 0.0,
+        "solidity": area / hull_area if hull_area else 0.0,
+        "image_ratio": area / image_area if image_area else None,
+    }
+
+
+def normalize_points(approx_contour, image_shape, canvas_size=CANVAS_SIZE):
+    """輪郭 (N,1,2) を中央寄せしてキャンバス座標 (N,2) の int32 配列に変換する"""
+    return normalize_contours([approx_contour], image_shape, canvas_size)[0]
+
+
+def normalize_contours(approx_contours, image_shape, canvas_size=CANVAS_SIZE):
+    """複数の輪郭を、全体が中央に来るように同じ変換でキャンバス座標 (N,2) の int32 配列に変換する"""
+    h, w = image_shape[:2]
+
+    # 中心に配置するためのオフセットを計算
+    points = np.concatenate([contour.reshape(-1, 2) for contour in approx_contours])
+    p_min = points.min(axis=0)
+    p_max = points.max(axis=0)
+    offset = (np.array([w, h]) - (p_max - p_min)) // 2 - p_min
+
+    scale = np.array([canvas_size[0] / w, canvas_size[1] / h])
+    return [((contour.reshape(-1, 2) + offset) * scale).astype(np.int32) for contour in approx_contours]
+
+
+@instrumentation.timed("render")
+def render_character(approx_contour, image_shape, line_thickness=5, style_option=STYLE_OUTLINE,
+                     canvas_size=CANVAS_SIZE, rng=None):
+    """
+    単純化した輪郭を白い背景に黒い線で描画し、グレースケール (uint8) の配列で返す
+
+    approx_contour に輪郭のリスト（複数輪郭モード）を渡すと、すべての輪郭をまとめて描く。
+    塗りつぶしは偶奇規則なので、外側の輪郭の中にある穴は塗られずに残る。
+    """
+    canvas = np.full((canvas_size[1], canvas_size[0]), 255, dtype=np.uint8)
+    contours = approx_contour if isinstance(approx_contour, (list, tuple)) else [approx_contour]
+    polygons = normalize_contours(contours, image_shape, canvas_size)
+    points = np.concatenate(polygons)
+
+    if style_option == STYLE_FILL:
+        cv2.fillPoly(canvas, polygons, 0)
+    else:
+        # 線を太くして象形文字らしく
+        # （OpenCV の太線は指定値より1px太く描かれるので、Pillow の width と見た目を揃える）
+        cv2.polylines(canvas, polygons, True, 0, thickness=max(1, line_thickness - 1))
+
+    if style_option == STYLE_TEXTURE:
+        # テクスチャ効果（ノイズや筆のストロークを模倣）
+        rng = rng if rng is not None else np.random.default_rng()
+        texture = canvas.copy()
+
+        # ポリゴン内部に短い線をランダムに描画してテクスチャを作成
+        p_min = points.min(axis=0)
+        p_max = points.max(axis=0)
+        starts = rng.integers(p_min, p_max + 1, size=(50, 2))
+        ends = starts + rng.integers(-30, 31, size=(50, 2))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            cv2.line(texture, start, end, 0, 1)
+
+        # 元の画像とテクスチャをブレンドし、少しぼかして古い象形文字のような効果を追加
+        canvas = cv2.addWeighted(canvas, 0.7, texture, 0.3, 0)
+        canvas = cv2.GaussianBlur(canvas, (0, 0), 0.5)
+
+    return canvas
+
+
+def extract_main_contour(work, edges, work_scale=1.0, retrieval_mode=cv2.RETR_EXTERNAL, min_area=0,
+                         threshold_fallback=False, input_scale=1.0, progress=None):
+    """
+    エッジ画像から最も大きい輪郭を取り出し、(輪郭, 統計) を読み込んだ画像（gray）の座標で返す（なければ None）
+
+    work はエッジ検出に使った（縮小済みの）グレースケール画像、work_scale はその縮小率。
+    統計は選択に使った contour_stats の行を gray の単位に戻したもの（単純化と特徴量で使い回す）。
+    面積のある輪郭がなく最初の輪郭を使ったときは None。
+    """
+    # min_area は元のファイルのピクセル単位なので、縮小画像の面積に換算して比較する
+    min_area *= (input_scale * work_scale) ** 2
+    _notify(progress, "輪郭検出を実行中...")
+    contours = find_contours(edges, retrieval_mode, min_area)
+    _notify(progress, f"検出された輪郭の数: {len(contours)}")
+
+    # 輪郭がない場合は閾値処理を試す
+    if not contours and threshold_fallback:
+        _notify(progress, "輪郭が検出されませんでした。別の方法を試します...")
+        _, thresh = cv2.threshold(work, 127, 255, cv2.THRESH_BINARY)
+        contours = find_contours(thresh, retrieval_mode, min_area)
+        _notify(progress, f"閾値処理後の輪郭の数: {len(contours)}")
+
+    # 面積などは輪郭ごとに1回だけ求め、選択とログの表示で使い回す
+    stats = contour_stats(contours, min_area, limit=1)
+    main_contour = select_main_contour(contours, min_area, stats)
+    if main_contour is None:
+        _notify(progress, "有効な輪郭が見つかりませんでした")
+        return None
+    main_contour = rescale_contour(main_contour, work_scale)
+    _notify(progress, f"メイン輪郭の面積: {stats['area'].max(initial=0) / work_scale ** 2:.2f}")
+    # limit=1 なので、残っていれば選ばれた輪郭の行
+    main_stats = rescale_stats(stats, work_scale)[0] if len(stats) else None
+    return main_contour, main_stats
+
+
+def extract_contours(work, edges, work_scale=1.0, min_area=0, threshold_fallback=False, input_scale=1.0,
+                     top_k=MULTI_CONTOUR_TOP_K, min_ratio=MULTI_CONTOUR_MIN_RATIO, progress=None):
+    """
+    複数輪郭モード: 輪郭の階層から外側の輪郭（面積の大きい順に top_k 個まで）と穴を取り出す
+
+    戻り値は (輪郭のリスト, 穴の数)。輪郭は外側の輪郭、穴の順で、読み込んだ画像（gray）の座標。
+    十分な大きさの輪郭がなければ、これまでどおり最も大きい輪郭だけを使う。それもなければ None。
+    """
+    # min_area は元のファイルのピクセル単位なので、縮小画像の面積に換算して比較する
+    tree_min_area = max(min_area * (input_scale * work_scale) ** 2, work.size * MULTI_CONTOUR_MIN_IMAGE_RATIO)
+    _notify(progress, "輪郭検出を実行中...")
+    contours, parents = find_contour_tree(edges, tree_min_area)
+    _notify(progress, f"検出された輪郭の数: {len(contours)}")
+
+    if not contours and threshold_fallback:
+        _notify(progress, "輪郭が検出されませんでした。別の方法を試します...")
+        _, thresh = cv2.threshold(work, 127, 255, cv2.THRESH_BINARY)
+        contours, parents = find_contour_tree(thresh, tree_min_area)
+        _notify(progress, f"閾値処理後の輪郭の数: {len(contours)}")
+
+    outers, holes = select_contours(contours, parents, top_k, min_ratio, tree_min_area)
+    if not outers:
+        _notify(progress, "大きな輪郭が見つからないので、最も大きい輪郭だけを使います")
+        extracted = extract_main_contour(work, edges, work_scale, cv2.RETR_EXTERNAL, min_area,
+                                         threshold_fallback, input_scale, progress)
+        return None if extracted is None else ([extracted[0]], 0)
+    _notify(progress, f"使用する輪郭: {len(outers)}個 (穴: {len(holes)}個)")
+    return [rescale_contour(contours[i], work_scale) for i in outers + holes], len(holes)
+
+
+def simplify_with_features(main_contour, contour_simplification=10, input_scale=1.0, image_shape=None,
+                           stats=None):
+    """
+    輪郭を単純化し、(単純化した輪郭, 元のファイルのピクセル単位の特徴量) を返す
+
+    stats には extract_main_contour が返した統計を渡す（周囲長・面積・外接矩形を計算し直さない）。
+    """
+    perimeter = None if stats is None else stats["perimeter"]
+    approx_contour = simplify_contour(main_contour, contour_simplification, perimeter)
+    features = extract_features(main_contour, approx_contour, image_shape, stats)
+    if input_scale != 1.0:
+        features["area"] /= input_scale * input_scale
+        features["perimeter"] /= input_scale
+    return approx_contour, features
+
+
+def simplify_contours_with_features(contours, hole_count, contour_simplification=10, input_scale=1.0,
+                                    image_shape=None):
+    """
+    複数輪郭モードの単純化。(単純化した輪郭のリスト, 特徴量) を返す
+
+    特徴量は最も大きい輪郭のもので、輪郭の数（contour_count）と穴の数（hole_count）が加わる。
+    """
+    stats = contour_stats(contours)
+    approx_contours = simplify_contours(contours, contour_simplification, stats)
+    features = extract_features(contours[0], approx_contours[0], image_shape, stats[0])
+    if input_scale != 1.0:
+        features["area"] /= input_scale * input_scale
+        features["perimeter"] /= input_scale
+    features["contour_count"] = len(contours) - hole_count
+    features["hole_count"] = hole_count
+    return approx_contours, features
+
+
+def generate_character(img, canny_threshold1=50, canny_threshold2=150, contour_simplification=10,
+                       line_thickness=5, style_option=STYLE_OUTLINE, retrieval_mode=cv2.RETR_EXTERNAL,
+                       min_area=0, threshold_fallback=False, working_size=None, input_scale=1.0,
+                       multi_contour=False, progress=None):
+    """
+    画像配列から象形文字を生成する
+
+    戻り値は (象形文字のグレースケール配列, 輪郭の特徴量)。
+    有効な輪郭が見つからない場合は (None, None) を返すので、代わりに何を表示するかは呼び出し側で決める。
+    working_size を指定すると、エッジ・輪郭検出は長辺をその大きさに縮小した画像で行い、
+    輪郭だけを元の座標に戻す（出力は 500x500 なので大きな写真でも見た目はほぼ変わらない）。
+    input_scale には load_gray / decode_gray が返した縮小率を渡す。特徴量の面積・周囲長は
+    元のファイルのピクセル単位に換算される。
+    multi_contour=True なら最も大きい輪郭だけでなく、輪郭の階層（RETR_TREE）から大きい順に
+    MULTI_CONTOUR_TOP_K 個までの輪郭と、その中の穴（目や取っ手の内側など）も描く（retrieval_mode は使わない）。
+    """
+    gray = to_gray(img)
+    work, work_scale = downscale(gray, working_size)
+    if work_scale != 1.0:
+        _notify(progress, f"作業解像度に縮小: {gray.shape[1]}x{gray.shape[0]} → {work.shape[1]}x{work.shape[0]}")
+
+    _notify(progress, "エッジ検出を実行中...")
+    edges = detect_edges(work, canny_threshold1, canny_threshold2)
+
+    if multi_contour:
+        extracted = extract_contours(work, edges, work_scale, min_area, threshold_fallback, input_scale,
+                                     progress=progress)
+        if extracted is None:
+            return None, None
+        approx_contour, features = simplify_contours_with_features(*extracted, contour_simplification,
+                                                                   input_scale, gray.shape)
+    else:
+        extracted = extract_main_contour(work, edges, work_scale, retrieval_mode, min_area,
+                                         threshold_fallback, input_scale, progress)
+        if extracted is None:
+            return None, None
+
+        main_contour, main_stats = extracted
+        approx_contour, features = simplify_with_features(main_contour, contour_simplification, input_scale,
+                                                          gray.shape, main_stats)
+    _notify(progress, f"単純化後の輪郭のポイント数: {features['points_count']}")
+
+    _notify(progress, "象形文字画像の生成を開始します")
+    character = render_character(approx_contour, gray.shape, line_thickness, style_option)
+    return character, features
+
+
+# StagedPipeline の各段階を計算し直すときに progress に送るメッセージ
+STAGE_MESSAGES = {
+    "decode": "画像を読み込み中...",
+    "working": "作業解像度に縮小中...",
+    "edges": "エッジ検出を実行中...",
+    "contours": "輪郭検出を実行中...",
+    "simplify": "輪郭を単純化中...",
+    "render": "象形文字を描画中...",
+}
+
+
+class StagedPipeline:
+    """
+    段階ごとに結果を覚えておく変換パイプライン
+
+    読み込み → エッジ → 輪郭 → 単純化 → 描画 の各段階は、自分の入力（パラメータと
+    前の段階の結果）が変わったときだけ計算し直す。スライダーで線の太さやスタイルだけを
+    変えたときは描画だけ、単純化レベルを変えたときは読み込みとCannyを飛ばして処理する。
+    """
+
+    def __init__(self, min_side=max(CANVAS_SIZE), working_size=None, retrieval_mode=cv2.RETR_EXTERNAL,
+                 min_area=0, threshold_fallback=False):
+        self.min_side = min_side
+        self.working_size = working_size
+        self.retrieval_mode = retrieval_mode
+        self.min_area = min_area
+        self.threshold_fallback = threshold_fallback
+        self._memo = {}
+        # 直前の run で計算し直した段階の名前（確認・計測用）
+        self.recomputed = []
+
+    def _stage(self, name, key, compute, progress=None):
+        cached = self._memo.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        # progress が例外を投げて中断しても、途中の結果は覚えないようにここで通知する
+        _notify(progress, STAGE_MESSAGES[name])
+        value = compute()
+        self._memo[name] = (key, value)
+        self.recomputed.append(name)
+        return value
+
+    def clear(self):
+        self._memo.clear()
+
+    def run(self, image_path, canny_threshold1=50, canny_threshold2=150, contour_simplification=10,
+            line_thickness=5, style_option=STYLE_OUTLINE, multi_contour=False, progress=None):
+        """
+        画像ファイルから象形文字を生成し、(象形文字, 特徴量, 読み込んだグレースケール画像) を返す
+
+        輪郭が見つからない場合、象形文字と特徴量は None（読み込みに失敗した場合は画像も None）。
+        multi_contour は generate_character と同じ（複数の輪郭と穴を描く）。
+        progress(message) は計算し直す段階の直前に呼ばれる。
+        """
+        self.recomputed = []
+
+        stat = os.stat(image_path)
+        decode_key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns, self.min_side)
+        gray, input_scale = self._stage("decode", decode_key, lambda: load_gray(image_path, self.min_side),
+                                        progress)
+        if gray is None:
+            return None, None, None
+
+        work_key = decode_key + (self.working_size,)
+        work, work_scale = self._stage("working", work_key, lambda: downscale(gray, self.working_size),
+                                       progress)
+
+        edges_key = work_key + (canny_threshold1, canny_threshold2)
+        edges = self._stage("edges", edges_key,
+                            lambda: detect_edges(work, canny_threshold1, canny_threshold2), progress)
+
+        contour_key = edges_key + (self.retrieval_mode, self.min_area, self.threshold_fallback, multi_contour)
+        if multi_contour:
+            extracted = self._stage("contours", contour_key, lambda: extract_contours(
+                work, edges, work_scale, self.min_area, self.threshold_fallback, input_scale), progress)
+        else:
+            extracted = self._stage("contours", contour_key, lambda: extract_main_contour(
+                work, edges, work_scale, self.retrieval_mode, self.min_area, self.threshold_fallback,
+                input_scale), progress)
+        if extracted is None:
+            return None, None, gray
+
+        simplify_key = contour_key + (contour_simplification,)
+        if multi_contour:
+            approx_contour, features = self._stage("simplify", simplify_key, lambda: simplify_contours_with_features(
+                *extracted, contour_simplification, input_scale, gray.shape), progress)
+        else:
+            approx_contour, features = self._stage("simplify", simplify_key, lambda: simplify_with_features(
+                extracted[0], contour_simplification, input_scale, gray.shape, extracted[1]), progress)
+
+        render_key = simplify_key + (line_thickness, style_option)
+        character = self._stage("render", render_key, lambda: render_character(
+            approx_contour, gray.shape, line_thickness, style_option), progress)
+        return character, features, gray
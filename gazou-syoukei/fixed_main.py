@@ -1,14 +1,20 @@
 import cv2
-import numpy as np
-from PIL import Image, ImageDraw
+from PIL import Image
 import tkinter as tk
-from tkinter import filedialog, Button, Label, Canvas, messagebox, Entry, StringVar
+from tkinter import filedialog, Button, Label, Canvas, messagebox, Entry, StringVar, BooleanVar, Checkbutton
 from PIL import ImageTk
 import os
 import traceback
 import json
 import threading
-from openai import OpenAI
+
+import engine
+import instrumentation
+import openai_client
+import descriptions
+
+# 説明文の生成にこれ以上かかる場合はオフラインの説明に切り替える（秒）
+DESCRIPTION_DEADLINE = 30
 
 class ImageToCharacterApp:
     def __init__(self, root):
@@ -17,6 +23,8 @@ class ImageToCharacterApp:
         self.root.geometry("800x700")
         
         self.input_image_path = None
+        self.input_gray = None  # 選択時に読み込んだグレースケール画像（変換時に再利用する）
+        self.input_scale = 1.0
         self.output_image = None
         self.api_key = StringVar()
         self.character_description = ""
@@ -27,6 +35,10 @@ class ImageToCharacterApp:
         # APIキーの読み込み
         self.load_api_key()
         
+        # 説明文をChatGPTを使わずにローカルで生成するか（APIキーがなければ最初からオン）
+        self.offline_mode = BooleanVar(value=self.client is None)
+        self.use_offline = self.offline_mode.get()
+        
         # UIの設定
         self.setup_ui()
     
@@ -41,6 +53,8 @@ class ImageToCharacterApp:
         
         Button(api_frame, text="保存", command=self.save_api_key).pack(side=tk.LEFT, padx=5)
         
+        Checkbutton(api_frame, text="説明をオフラインで生成", variable=self.offline_mode).pack(side=tk.LEFT, padx=5)
+        
         # 上部フレーム（ボタン用）
         top_frame = tk.Frame(self.root)
         top_frame.pack(pady=10)
@@ -122,7 +136,7 @@ class ImageToCharacterApp:
                     data = json.load(f)
                     self.api_key.set(data.get("api_key", ""))
                     if self.api_key.get():
-                        self.client = OpenAI(api_key=self.api_key.get())
+                        self.client = openai_client.get_client(api_key=self.api_key.get())
                         print("OpenAIクライアントを初期化しました")
         except Exception as e:
             print(f"APIキーの読み込みエラー: {str(e)}")
@@ -137,7 +151,7 @@ class ImageToCharacterApp:
                 
                 with open(api_key_path, "w") as f:
                     json.dump({"api_key": api_key}, f)
-                self.client = OpenAI(api_key=api_key)
+                self.client = openai_client.get_client(api_key=api_key)
                 messagebox.showinfo("成功", "APIキーが保存されました")
                 print("OpenAIクライアントを初期化しました")
             else:
@@ -153,13 +167,15 @@ class ImageToCharacterApp:
         
         if file_path:
             try:
-                # 画像が読み込めるか確認
-                test_img = cv2.imread(file_path)
-                if test_img is None:
+                # 画像が読み込めるか確認（読み込んだ画像はそのまま変換にも使う）
+                gray, input_scale = engine.load_gray(file_path)
+                if gray is None:
                     messagebox.showerror("エラー", "画像を読み込めませんでした。別の画像を選択してください。")
                     return
                 
                 self.input_image_path = file_path
+                self.input_gray = gray
+                self.input_scale = input_scale
                 self.display_input_image()
                 self.convert_btn.config(state=tk.NORMAL)
                 self.status_label.config(text=f"選択された画像: {os.path.basename(file_path)}")
@@ -196,8 +212,10 @@ class ImageToCharacterApp:
         if not self.input_image_path:
             return
         
-        if not self.api_key.get() or not self.client:
-            messagebox.showwarning("警告", "OpenAI APIキーが設定されていません。APIキーを入力して保存してください。")
+        # Tk の変数はメインスレッドでしか読めないので、処理を始める前に取り出しておく
+        self.use_offline = self.offline_mode.get()
+        if not self.use_offline and (not self.api_key.get() or not self.client):
+            messagebox.showwarning("警告", "OpenAI APIキーが設定されていません。APIキーを入力して保存するか、「説明をオフラインで生成」を選んでください。")
             return
         
         try:
@@ -303,123 +321,54 @@ class ImageToCharacterApp:
         self.status_label.config(text="エラーが発生しました")
         messagebox.showerror("エラー", f"変換中にエラーが発生しました: {error_message}")
     
+    @instrumentation.traced("fixed_main")
     def generate_character_from_image(self, image_path):
         try:
-            # 画像を読み込み
-            self.update_process_text(f"画像を読み込み中: {image_path}")
-            print(f"画像を読み込み中: {image_path}")
-            img = cv2.imread(image_path)
-            if img is None:
+            # 画像を読み込み（選択時に読み込み済みならそれを使う）
+            if image_path == self.input_image_path and self.input_gray is not None:
+                gray, input_scale = self.input_gray, self.input_scale
+            else:
+                self.update_process_text(f"画像を読み込み中: {image_path}")
+                print(f"画像を読み込み中: {image_path}")
+                gray, input_scale = engine.load_gray(image_path)
+            if gray is None:
                 self.update_process_text("画像の読み込みに失敗しました")
                 print("画像の読み込みに失敗しました")
                 return None, ""
             
-            self.update_process_text(f"画像サイズ: {img.shape}")
-            print(f"画像サイズ: {img.shape}")
-            
-            # グレースケール変換
-            self.update_process_text("グレースケールに変換中...")
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            self.update_process_text(f"画像サイズ: {gray.shape} (読み込み倍率: {input_scale})")
+            print(f"画像サイズ: {gray.shape}")
             
-            # エッジ検出
-            self.update_process_text("エッジ検出を実行中...")
-            edges = cv2.Canny(gray, 30, 100)  # しきい値を調整
-            self.update_process_text("エッジ検出完了")
-            
-            # 輪郭検出
-            self.update_process_text("輪郭検出を実行中...")
-            contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-            self.update_process_text(f"検出された輪郭の数: {len(contours)}")
-            
-            # 輪郭がない場合は別の方法を試す
-            if not contours:
-                self.update_process_text("輪郭が検出されませんでした。別の方法を試します...")
-                # 閾値処理を試す
-                _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
-                contours, _ = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-                self.update_process_text(f"閾値処理後の輪郭の数: {len(contours)}")
+            # 輪郭を抽出して象形文字を生成（小さすぎる輪郭は除外し、見つからなければ閾値処理を試す）
+            character, contour_features = engine.generate_character(
+                gray,
+                canny_threshold1=30,  # しきい値を調整
+                canny_threshold2=100,
+                retrieval_mode=cv2.RETR_LIST,
+                min_area=100,
+                threshold_fallback=True,
+                input_scale=input_scale,
+                progress=self.update_process_text
+            )
             
-            # 最も大きい輪郭を取得
-            if contours:
-                # 面積でフィルタリング（小さすぎる輪郭を除外）
-                filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) > 100]
+            if character is not None:
+                # 画像ファイル名から対象物を推測
+                file_name = os.path.basename(image_path)
+                file_name_without_ext = os.path.splitext(file_name)[0]
+                self.update_process_text(f"画像ファイル名: {file_name_without_ext}")
                 
-                if filtered_contours:
-                    main_contour = max(filtered_contours, key=cv2.contourArea)
-                    self.update_process_text(f"メイン輪郭の面積: {cv2.contourArea(main_contour):.2f}")
-                    
-                    # 輪郭を単純化
-                    epsilon = 0.01 * cv2.arcLength(main_contour, True)
-                    approx_contour = cv2.approxPolyDP(main_contour, epsilon, True)
-                    self.update_process_text(f"単純化後の輪郭のポイント数: {len(approx_contour)}")
-                    
-                    # 輪郭の特徴を抽出
-                    contour_features = {
-                        "points_count": len(approx_contour),
-                        "is_closed": True,
-                        "area": cv2.contourArea(main_contour),
-                        "perimeter": cv2.arcLength(main_contour, True),
-                        "is_convex": cv2.isContourConvex(approx_contour)
-                    }
-                    
-                    # 画像ファイル名から対象物を推測
-                    file_name = os.path.basename(image_path)
-                    file_name_without_ext = os.path.splitext(file_name)[0]
-                    self.update_process_text(f"画像ファイル名: {file_name_without_ext}")
-                    
-                    # ChatGPT APIを使用して象形文字の説明を生成
-                    self.update_process_text("ChatGPT APIを使用して説明を生成中...")
-                    print("ChatGPT APIを使用して説明を生成します...")
-                    description = self.generate_character_description(contour_features, file_name_without_ext)
-                    self.update_process_text(f"説明の生成完了: {description[:30]}...")
-                    print(f"説明の生成完了: {description[:30]}...")
-                    
-                    # 象形文字のような画像を生成
-                    self.update_process_text("象形文字画像の生成を開始します")
-                    # 白い背景に黒い線で描画
-                    canvas_size = (500, 500)
-                    character_img = Image.new('RGB', canvas_size, color='white')
-                    draw = ImageDraw.Draw(character_img)
-                    self.update_process_text("キャンバスの作成完了")
-                    
-                    # 輪郭の座標を正規化して描画
-                    h, w = gray.shape
-                    scale_x = canvas_size[0] / w
-                    scale_y = canvas_size[1] / h
-                    
-                    # 中心に配置するためのオフセットを計算
-                    x_min = min(point[0][0] for point in approx_contour)
-                    y_min = min(point[0][1] for point in approx_contour)
-                    x_max = max(point[0][0] for point in approx_contour)
-                    y_max = max(point[0][1] for point in approx_contour)
-                    
-                    contour_width = x_max - x_min
-                    contour_height = y_max - y_min
-                    
-                    offset_x = (w - contour_width) // 2 - x_min
-                    offset_y = (h - contour_height) // 2 - y_min
-                    
-                    # 輪郭を描画
-                    points = []
-                    for point in approx_contour:
-                        x = int((point[0][0] + offset_x) * scale_x)
-                        y = int((point[0][1] + offset_y) * scale_y)
-                        points.append((x, y))
-                    
-                    self.update_process_text(f"描画するポイント数: {len(points)}")
-                    
-                    # 線を太くして象形文字らしく
-                    for i in range(len(points)):
-                        start = points[i]
-                        end = points[(i + 1) % len(points)]
-                        draw.line([start, end], fill='black', width=5)
-                    
-                    self.update_process_text("象形文字の生成が完了しました")
-                    print(f"character_img の種類: {type(character_img)}")
-                    print(f"character_img のサイズ: {character_img.size}")
-                    return character_img, description
-                else:
-                    self.update_process_text("有効な輪郭が見つかりませんでした")
+                # ChatGPT APIを使用して象形文字の説明を生成
+                self.update_process_text("ChatGPT APIを使用して説明を生成中...")
+                print("ChatGPT APIを使用して説明を生成します...")
+                description = self.generate_character_description(contour_features, file_name_without_ext)
+                self.update_process_text(f"説明の生成完了: {description[:30]}...")
+                print(f"説明の生成完了: {description[:30]}...")
+                
+                character_img = Image.fromarray(character)
+                self.update_process_text("象形文字の生成が完了しました")
+                print(f"character_img の種類: {type(character_img)}")
+                print(f"character_img のサイズ: {character_img.size}")
+                return character_img, description
             
             # 輪郭が見つからない場合は元の画像をグレースケールで返す
             self.update_process_text("輪郭が見つからないため、元の画像を処理します")
@@ -445,36 +394,31 @@ class ImageToCharacterApp:
         try:
             self.update_process_text("説明生成メソッドを呼び出し中...")
             print("generate_character_description メソッドが呼び出されました")
+            if self.use_offline:
+                description = descriptions.offline_description(image_name, contour_features)
+                self.update_process_text(f"オフラインで説明を生成しました: {description[:50]}...")
+                return description
             if not self.client:
                 self.update_process_text("OpenAI クライアントが初期化されていません")
                 print("OpenAI クライアントが初期化されていません")
                 return "OpenAI APIクライアントが初期化されていません。APIキーを設定してください。"
                 
             # OpenAI APIを使用して象形文字の説明を生成
-            prompt = f"""
-            以下の特徴を持つ輪郭から生成された象形文字について、古代文字のような説明を100文字程度で作成してください。
-            説明は「この象形文字は...」で始めてください。
-
-            - 画像名: {image_name}
-            - 点の数: {contour_features['points_count']}
-            - 閉じた形状: {'はい' if contour_features['is_closed'] else 'いいえ'}
-            - 面積: {contour_features['area']:.2f}
-            - 周囲長: {contour_features['perimeter']:.2f}
-            - 凸形状: {'はい' if contour_features['is_convex'] else 'いいえ'}
-            """
+            prompt = descriptions.build_prompt(image_name, contour_features)
             
             self.update_process_text("OpenAI API リクエストを送信中...")
             print("OpenAI API リクエストを送信します...")
             try:
                 self.update_process_text("ChatGPT APIに接続中...")
-                response = self.client.chat.completions.create(
-                    model="gpt-3.5-turbo",
+                response = self.client.chat_completion(
+                    model=descriptions.DEFAULT_MODEL,
                     messages=[
-                        {"role": "system", "content": "あなたは古代文字の専門家です。象形文字の特徴から、その意味や用途を説明してください。"},
+                        {"role": "system", "content": descriptions.SYSTEM_MESSAGE},
                         {"role": "user", "content": prompt}
                     ],
                     max_tokens=200,
-                    temperature=0.7
+                    temperature=0.7,
+                    deadline=DESCRIPTION_DEADLINE
                 )
                 
                 description = response.choices[0].message.content.strip()
@@ -488,7 +432,7 @@ class ImageToCharacterApp:
                 print(error_msg)
                 print(traceback.format_exc())
                 # APIエラーが発生しても説明を返す
-                fallback_msg = f"この象形文字は{image_name}を表しています。古代の人々はこの形を使って重要な概念を表現していました。"
+                fallback_msg = descriptions.offline_description(image_name, contour_features)
                 self.update_process_text(f"デフォルトの説明を使用します: {fallback_msg[:30]}...")
                 return fallback_msg
             
@@ -498,31 +442,31 @@ class ImageToCharacterApp:
             print(error_msg)
             print(traceback.format_exc())
             # エラーが発生しても説明を返す
-            return f"この象形文字は{image_name}を表しています。古代の人々はこの形を使って重要な概念を表現していました。"
+            return descriptions.offline_description(image_name, contour_features)
     
     def generate_simple_description(self, image_name):
         try:
             self.update_process_text("簡易説明生成メソッドを呼び出し中...")
+            if self.use_offline:
+                return descriptions.offline_description(image_name)
             if not self.client:
                 self.update_process_text("OpenAI クライアントが初期化されていません")
                 return "OpenAI APIクライアントが初期化されていません。APIキーを設定してください。"
                 
             # 輪郭が見つからない場合の簡単な説明
-            prompt = f"""
-            「{image_name}」という名前の画像から生成された象形文字について、古代文字のような説明を100文字程度で作成してください。
-            説明は「この象形文字は...」で始めてください。
-            """
+            prompt = descriptions.build_prompt(image_name)
             
             self.update_process_text("OpenAI API リクエストを送信中（簡易説明）...")
             try:
-                response = self.client.chat.completions.create(
-                    model="gpt-3.5-turbo",
+                response = self.client.chat_completion(
+                    model=descriptions.DEFAULT_MODEL,
                     messages=[
-                        {"role": "system", "content": "あなたは古代文字の専門家です。象形文字の特徴から、その意味や用途を説明してください。"},
+                        {"role": "system", "content": descriptions.SYSTEM_MESSAGE},
                         {"role": "user", "content": prompt}
                     ],
                     max_tokens=200,
-                    temperature=0.7
+                    temperature=0.7,
+                    deadline=DESCRIPTION_DEADLINE
                 )
                 
                 description = response.choices[0].message.content.strip()
@@ -534,7 +478,7 @@ class ImageToCharacterApp:
                 self.update_process_text(error_msg)
                 print(error_msg)
                 # APIエラーが発生しても説明を返す
-                return f"この象形文字は{image_name}を表しています。古代の人々はこの形を使って重要な概念を表現していました。"
+                return descriptions.offline_description(image_name)
                 
         except Exception as e:
             error_msg = f"説明の生成中にエラーが発生しました: {str(e)}"
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+変換処理の段階ごとの計測（実時間・CPU 時間・メモリ）
+
+  with instrumentation.trace("convert", source="cup.jpg"):
+      ...                                   # この中で呼ばれた段階がまとめて1行の JSON になる
+
+  @instrumentation.timed("canny")
+  def detect_edges(...): ...
+
+  with instrumentation.span("openai.images.generate", model="dall-e-3"):
+      ...
+
+  @instrumentation.traced("main")          # 呼び出し1回を1つのトレースにする
+  def generate_character_from_image(...): ...
+
+環境変数 TRACE=1（または enable()）で有効になる。無効のときの span / timed は
+何も記録せず、関数呼び出し1回分のコストしかかからない。
+  - TRACE_FILE … トレースを JSON Lines で追記するファイル（指定がなければ標準出力）
+  - TRACE_MEMORY=1 … tracemalloc でトレースごとのメモリ確保量のピークも測る（遅くなる。
+    ピークはプロセスで1つなので、変換を1件ずつ実行して調べるとき用）
+段階ごとのメモリは、段階の終了時と開始時の差（mem_delta_kb）を記録する。TRACE_MEMORY=1 なら
+tracemalloc で確保中の量の差、それ以外は常駐メモリ（RSS）の差。どちらもプロセス全体の値なので、
+同時に動く他のリクエストの分も混ざる。
+段階ごとの集計は prometheus_text() で Prometheus のテキスト形式として取り出せる。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import functools
+import threading
+import contextvars
+
+try:
+    import resource
+except ImportError:   # Windows
+    resource = None
+
+# Prometheus のヒストグラムの区切り（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = os.environ.get("TRACE", "").lower() in ("1", "true", "on", "yes")
+_trace_file = os.environ.get("TRACE_FILE") or None
+_trace_memory = os.environ.get("TRACE_MEMORY", "").lower() in ("1", "true", "on", "yes")
+
+if _trace_memory:
+    import tracemalloc
+    tracemalloc.start()
+
+_current = contextvars.ContextVar("instrumentation_trace", default=None)
+# 実行中の段階（入れ子の段階の CPU 時間をトレースの合計に二重に数えないため）
+_current_span = contextvars.ContextVar("instrumentation_span", default=None)
+_write_lock = threading.Lock()
+
+
+def enable(trace_file=None, memory=False):
+    """計測を有効にする（trace_file を省略すると標準出力に書く）"""
+    global _enabled, _trace_file, _trace_memory
+    _enabled = True
+    _trace_file = trace_file
+    _trace_memory = memory
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def _page_size():
+    try:
+        return os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+_PAGE_SIZE = _page_size()
+
+
+def current_rss_bytes():
+    """プロセスの今の常駐メモリ（バイト）。/proc のない環境では None"""
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _memory_now():
+    """段階のメモリの差を測るための今の値（バイト）。測れなければ None"""
+    if _trace_memory:
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+    return current_rss_bytes()
+
+
+def peak_rss_kb():
+    """プロセスの最大常駐メモリ（KB）。取得できない環境では None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux は KB で返る
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def annotate(self, **attrs):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    """
+    段階1つの計測
+
+    CPU 時間はその段階を実行したスレッドのもの。await をはさむ段階（cpu=False）は、
+    待っている間に同じスレッドで動く他のリクエストの CPU 時間が混ざるので CPU 時間を記録しない。
+    """
+
+    def __init__(self, trace, name, attrs, cpu=True):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.cpu = cpu
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self._memory = _memory_now()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu if self.cpu else 0.0
+        memory = _memory_now()
+        memory = memory - self._memory if memory is not None and self._memory is not None else None
+        _current_span.reset(self._token)
+        record = {"stage": self.name, "wall_ms": round(wall * 1000, 3)}
+        if self.cpu:
+            record["cpu_ms"] = round(cpu * 1000, 3)
+        if memory is not None:
+            record["mem_delta_kb"] = memory // 1024 if memory >= 0 else -(-memory // 1024)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if self.attrs:
+            record.update(self.attrs)
+        metrics.observe(self.name, wall, cpu, exc_type is not None, memory)
+        if self.trace is not None:
+            self.trace.stages.append(record)
+            if _current_span.get() is None:
+                self.trace.cpu += cpu
+        return False
+
+
+class Trace:
+    """
+    1回の変換の段階ごとの記録。終了時に JSON Lines として書き出す
+
+    cpu_ms は段階の CPU 時間の合計（入れ子の段階は外側の段階に含まれる）。同じプロセスで
+    同時に動く他のリクエストの CPU 時間は含まない。段階の外で使った CPU 時間も含まない。
+    """
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.stages = []
+        self.cpu = 0.0
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._span_token = _current_span.set(None)
+        if _trace_memory:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+                self._mem_start = tracemalloc.get_traced_memory()[0]
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        _current_span.reset(self._span_token)
+        self.wall_ms = round((time.perf_counter() - self._wall) * 1000, 3)
+        self.cpu_ms = round(self.cpu * 1000, 3)
+        if _trace_memory and hasattr(self, "_mem_start"):
+            import tracemalloc
+            # 他のスレッドでの解放で負にならないようにする
+            self.attrs["alloc_peak_kb"] = max(0, tracemalloc.get_traced_memory()[1] - self._mem_start) // 1024
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        if _enabled:
+            _write(self.to_dict())
+        return False
+
+    def annotate(self, **attrs):
+        """終わるまでにわかった情報（使ったモデルなど）をトレースに加える"""
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {"trace": self.name, "id": self.trace_id, "time": time.time(), "wall_ms": self.wall_ms,
+                "cpu_ms": self.cpu_ms, "peak_rss_kb": peak_rss_kb(), **self.attrs, "stages": self.stages}
+
+    def summary(self):
+        """ログ表示用の1行（段階ごとの実時間）"""
+        parts = [f"{stage['stage']} {stage['wall_ms']:.1f}ms" for stage in self.stages]
+        return f"合計 {self.wall_ms:.1f}ms: " + ", ".join(parts)
+
+
+def _write(record):
+    line = json.dumps(record, ensure_ascii=False)
+    with _write_lock:
+        if _trace_file:
+            with open(_trace_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        else:
+            print(line)
+
+
+def trace(name, always=False, **attrs):
+    """
+    変換1回分のトレースを始める
+
+    無効のときは何もしない。always=True なら無効でも段階を記録する（画面のログに出すためなど）。
+    """
+    if not _enabled and not always:
+        return _NOOP
+    return Trace(name, attrs)
+
+
+def span(name, cpu=True, **attrs):
+    """
+    段階の計測。トレースの中なら記録し、有効なら集計にも加える
+
+    await をはさむ段階は cpu=False にする（CPU 時間を記録しない）。
+    """
+    current = _current.get()
+    if current is None and not _enabled:
+        return _NOOP
+    return Span(current, name, attrs, cpu)
+
+
+def timed(name):
+    """関数全体を1つの段階として計測するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled and _current.get() is None:
+                return func(*args, **kwargs)
+            with Span(_current.get(), name, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced(name):
+    """関数の呼び出し1回を1つのトレースとして記録するデコレーター（GUI の変換処理など）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Trace(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class StageMetrics:
+    """
+    段階ごとの回数・エラー数・実時間のヒストグラム・CPU 時間の合計・メモリの増加量
+
+    メモリは段階の前後の差のうち増えた分の合計と、1回の最大値（減った回は 0 として数える）。
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, wall, cpu, error=False, memory=None):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = {"count": 0, "errors": 0, "wall": 0.0, "cpu": 0.0, "memory": 0, "memory_max": 0,
+                         "buckets": [0] * len(self.buckets)}
+                self._stages[stage] = entry
+            entry["count"] += 1
+            entry["errors"] += int(error)
+            entry["wall"] += wall
+            entry["cpu"] += cpu
+            if memory is not None and memory > 0:
+                entry["memory"] += memory
+                entry["memory_max"] = max(entry["memory_max"], memory)
+            for i, bound in enumerate(self.buckets):
+                if wall <= bound:
+                    entry["buckets"][i] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: {"count": e["count"], "errors": e["errors"], "wall_seconds": round(e["wall"], 6),
+                            "cpu_seconds": round(e["cpu"], 6), "memory_bytes": e["memory"],
+                            "memory_max_bytes": e["memory_max"]} for stage, e in self._stages.items()}
+
+    def prometheus_text(self, prefix="syoukei"):
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time of each conversion stage.",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = {stage: dict(e, buckets=list(e["buckets"])) for stage, e in self._stages.items()}
+        for stage, e in sorted(stages.items()):
+            for bound, count in zip(self.buckets, e["buckets"]):
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {e["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {e["wall"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {e["count"]}')
+        lines += [f"# HELP {prefix}_stage_cpu_seconds_total CPU time spent in each stage.",
+                  f"# TYPE {prefix}_stage_cpu_seconds_total counter"]
+        lines += [f'{prefix}_stage_cpu_seconds_total{{stage="{stage}"}} {e["cpu"]:.6f}'
+                  for stage, e in sorted(stages.items())]
+        lines += [f"# HELP {prefix}_stage_errors_total Stages that raised an exception.",
+                  f"# TYPE {prefix}_stage_errors_total counter"]
+        lines += [f'{prefix}_stage_errors_total{{stage="{stage}"}} {e["errors"]}'
+                  for stage, e in sorted(stages.items())]
+        lines += [f"# HELP {prefix}_stage_memory_bytes_total Memory growth during each stage (sum of positive deltas).",
+                  f"# TYPE {prefix}_stage_memory_bytes_total counter"]
+        lines += [f'{prefix}_stage_memory_bytes_total{{stage="{stage}"}} {e["memory"]}'
+                  for stage, e in sorted(stages.items())]
+        lines += [f"# HELP {prefix}_stage_memory_max_bytes Largest memory growth seen in a single run of each stage.",
+                  f"# TYPE {prefix}_stage_memory_max_bytes gauge"]
+        lines += [f'{prefix}_stage_memory_max_bytes{{stage="{stage}"}} {e["memory_max"]}'
+                  for stage, e in sorted(stages.items())]
+        peak = peak_rss_kb()
+        if peak is not None:
+            lines += [f"# HELP {prefix}_peak_rss_bytes Peak resident set size of the process.",
+                      f"# TYPE {prefix}_peak_rss_bytes gauge",
+                      f"{prefix}_peak_rss_bytes {peak * 1024}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = StageMetrics()
+
+
+def prometheus_text():
+    return metrics.prometheus_text()
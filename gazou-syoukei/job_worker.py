@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Tk アプリ用のバックグラウンドワーカー
+
+重い処理を1本のワーカースレッドで実行し、結果は root.after でメインスレッドに渡す。
+新しいジョブが投入されると、まだ始まっていない古いジョブは捨てられ、
+実行中のジョブも job.is_cancelled() を確認するか job.report() を呼んだ時点でやめられる。
+"""
+import threading
+import traceback
+
+
+class JobCancelled(Exception):
+    """新しいジョブに置き換えられたジョブの中断に使う"""
+
+
+class Job:
+    def __init__(self, worker, generation, func, on_done, on_error, on_progress):
+        self._worker = worker
+        self.generation = generation
+        self.func = func
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+
+    def is_cancelled(self):
+        """後から新しいジョブが投入されていれば True"""
+        return self._worker.is_superseded(self)
+
+    def report(self, message):
+        """
+        進捗を on_progress に送る（ワーカースレッドから呼ぶ）
+
+        ジョブが置き換えられていた場合は JobCancelled を投げて処理を打ち切る。
+        """
+        if self.is_cancelled():
+            raise JobCancelled()
+        self._worker._deliver(self, self.on_progress, message)
+
+
+class JobWorker:
+    def __init__(self, root, name="job-worker"):
+        self.root = root
+        self._condition = threading.Condition()
+        self._pending = None
+        self._generation = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, func, on_done=None, on_error=None, on_progress=None):
+        """
+        func(job) をワーカースレッドで実行する
+
+        on_done(result) / on_error(exception) / on_progress(message) はメインスレッドで呼ばれる。
+        結果が届く前に次のジョブが投入された場合は、どれも呼ばれない。
+        """
+        with self._condition:
+            self._generation += 1
+            job = Job(self, self._generation, func, on_done, on_error, on_progress)
+            self._pending = job
+            self._condition.notify()
+        return job
+
+    def cancel(self):
+        """実行待ち・実行中のジョブをすべて無効にする"""
+        with self._condition:
+            self._generation += 1
+            self._pending = None
+
+    def is_superseded(self, job):
+        return job.generation != self._generation
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._generation += 1
+            self._pending = None
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                job, self._pending = self._pending, None
+
+            try:
+                result = job.func(job)
+            except JobCancelled:
+                continue
+            except Exception as e:
+                print(f"バックグラウンド処理でエラーが発生しました: {str(e)}")
+                print(traceback.format_exc())
+                self._deliver(job, job.on_error, e)
+            else:
+                self._deliver(job, job.on_done, result)
+
+    def _deliver(self, job, callback, value):
+        if callback is None or job.is_cancelled():
+            return
+
+        def _call():
+            # メインスレッドに届くまでの間に新しいジョブが来ていたら捨てる
+            if not job.is_cancelled():
+                callback(value)
+
+        try:
+            self.root.after(0, _call)
+        except RuntimeError:
+            # ウィンドウが閉じられた後は何もしない
+            pass
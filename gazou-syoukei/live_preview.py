@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+パラメータのスライダーを動かしたときのライブプレビュー
+
+スライダーの変更はまとめて（デバウンスして）から、縮小したプレビュー用の画像で
+バックグラウンド変換する。読み込み・エッジなどの中間結果は StagedPipeline が
+覚えているので、線の太さやスタイルの変更は描画だけで済む。
+"""
+import engine
+from job_worker import JobWorker
+
+# プレビュー用に縮小する画像の長辺（表示領域が 400px 程度なので少し余裕を持たせる）
+PREVIEW_SIZE = 512
+
+
+class LivePreview:
+    def __init__(self, root, get_params, on_preview, delay_ms=120, preview_size=PREVIEW_SIZE):
+        """
+        get_params() はメインスレッドで呼ばれ、変換パラメータの dict を返す。
+        on_preview(character, gray) はメインスレッドで呼ばれる（輪郭がなければ character は None）。
+        """
+        self.root = root
+        self.get_params = get_params
+        self.on_preview = on_preview
+        self.delay_ms = delay_ms
+        self.preview_size = preview_size
+        self.image_path = None
+        self.pipeline = None
+        self._after_id = None
+        self._worker = JobWorker(root, name="live-preview")
+
+    def set_image(self, image_path):
+        """新しい画像を選択したときに呼ぶ（中間結果は捨てる）"""
+        self._worker.cancel()
+        self.image_path = image_path
+        self.pipeline = engine.StagedPipeline(min_side=self.preview_size, working_size=self.preview_size)
+        self.schedule()
+
+    def schedule(self, *_):
+        """スライダーなどの command から呼ぶ。最後の変更から delay_ms 後に再計算する"""
+        if self.image_path is None:
+            return
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+        self._after_id = self.root.after(self.delay_ms, self._start)
+
+    def cancel(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        self._worker.cancel()
+
+    def _start(self):
+        self._after_id = None
+        # Tk の変数はメインスレッドでしか読めないので、ここで値を取り出して渡す
+        params = self.get_params()
+        image_path = self.image_path
+        pipeline = self.pipeline
+
+        def _work(job):
+            # 次の変更が来ていたら、段階の切れ目で job.report が処理を打ち切る
+            character, _, gray = pipeline.run(image_path, progress=job.report, **params)
+            return character, gray
+
+        self._worker.submit(_work, on_done=lambda result: self.on_preview(*result))
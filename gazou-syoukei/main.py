@@ -1,11 +1,13 @@
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw
+from PIL import Image
 import tkinter as tk
 from tkinter import filedialog, Button, Label, Canvas
 from PIL import ImageTk
 import os
 
+import engine
+import instrumentation
+from job_worker import JobWorker
+
 class ImageToCharacterApp:
     def __init__(self, root):
         self.root = root
@@ -15,6 +17,9 @@ class ImageToCharacterApp:
         self.input_image_path = None
         self.output_image = None
         
+        # 変換はバックグラウンドで実行する（新しい変換を始めると古い変換は破棄される）
+        self.worker = JobWorker(self.root)
+        
         # UIの設定
         self.setup_ui()
     
@@ -103,76 +108,41 @@ class ImageToCharacterApp:
             return
         
         self.status_label.config(text="変換中...")
-        self.root.update()
-        
-        # 画像から特徴を抽出し、象形文字を生成
-        self.output_image = self.generate_character_from_image(self.input_image_path)
         
-        # 結果を表示
+        # 画像から特徴を抽出し、象形文字を生成（ワーカースレッドで実行）
+        image_path = self.input_image_path
+        self.worker.submit(
+            lambda job: self.generate_character_from_image(image_path, progress=job.report),
+            on_done=self._on_conversion_done,
+            on_error=self._on_conversion_error,
+            on_progress=lambda message: self.status_label.config(text=f"変換中... {message}")
+        )
+    
+    def _on_conversion_done(self, output_image):
+        # 結果を表示（メインスレッドで呼ばれる）
+        self.output_image = output_image
         self.display_output_image()
         self.save_btn.config(state=tk.NORMAL)
         self.status_label.config(text="変換完了")
     
-    def generate_character_from_image(self, image_path):
-        # 画像を読み込み
-        img = cv2.imread(image_path)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # エッジ検出
-        edges = cv2.Canny(gray, 50, 150)
+    def _on_conversion_error(self, error):
+        self.status_label.config(text=f"変換中にエラーが発生しました: {str(error)}")
+    
+    @instrumentation.traced("main")
+    def generate_character_from_image(self, image_path, progress=None):
+        # 画像をグレースケールで縮小読み込み（大きなJPEGはデコード時に縮小される）
+        gray, input_scale = engine.load_gray(image_path)
+        if gray is None:
+            raise ValueError("画像を読み込めませんでした")
         
-        # 輪郭検出
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # 輪郭を抽出して象形文字を生成
+        character, _ = engine.generate_character(gray, input_scale=input_scale, progress=progress)
         
-        # 最も大きい輪郭を取得
-        if contours:
-            main_contour = max(contours, key=cv2.contourArea)
-            
-            # 輪郭を単純化
-            epsilon = 0.01 * cv2.arcLength(main_contour, True)
-            approx_contour = cv2.approxPolyDP(main_contour, epsilon, True)
-            
-            # 象形文字のような画像を生成
-            # 白い背景に黒い線で描画
-            canvas_size = (500, 500)
-            character_img = Image.new('RGB', canvas_size, color='white')
-            draw = ImageDraw.Draw(character_img)
-            
-            # 輪郭の座標を正規化して描画
-            h, w = edges.shape
-            scale_x = canvas_size[0] / w
-            scale_y = canvas_size[1] / h
-            
-            # 中心に配置するためのオフセットを計算
-            x_min = min(point[0][0] for point in approx_contour)
-            y_min = min(point[0][1] for point in approx_contour)
-            x_max = max(point[0][0] for point in approx_contour)
-            y_max = max(point[0][1] for point in approx_contour)
-            
-            contour_width = x_max - x_min
-            contour_height = y_max - y_min
-            
-            offset_x = (w - contour_width) // 2 - x_min
-            offset_y = (h - contour_height) // 2 - y_min
-            
-            # 輪郭を描画
-            points = []
-            for point in approx_contour:
-                x = int((point[0][0] + offset_x) * scale_x)
-                y = int((point[0][1] + offset_y) * scale_y)
-                points.append((x, y))
-            
-            # 線を太くして象形文字らしく
-            for i in range(len(points)):
-                start = points[i]
-                end = points[(i + 1) % len(points)]
-                draw.line([start, end], fill='black', width=5)
-            
-            return character_img
-        else:
+        if character is None:
             # 輪郭が見つからない場合は元の画像をグレースケールで返す
-            pil_img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-            return pil_img
+            return Image.fromarray(gray)
+        
+        return Image.fromarray(character)
     
     def display_output_image(self):
         if self.output_image:
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+すべてのアプリで共有する OpenAI API クライアント
+
+AsyncOpenAI を専用のイベントループ（バックグラウンドスレッド）で動かし、
+HTTP の接続プール（keep-alive）と同時実行数の上限を1か所で管理する。
+Tk アプリや Flask の同期ビューからは chat_completion() などを普通に呼べばよく、
+非同期のコードからは achat_completion() などを await すれば、同じ接続プールで
+多数のリクエストを同時に流せる。
+
+接続先は base_url（または環境変数 OPENAI_BASE_URL）で切り替えられるので、
+ローカルのモックサーバーに向けて動作確認ができる。
+
+再試行は SDK に任せず（max_retries=0）、resilience.py の RetryPolicy で行う。
+エンドポイントとモデルの組ごとに CircuitBreaker を持ち、失敗が続くモデルは
+しばらく呼ばずに CircuitOpen を投げる。各呼び出しには deadline=秒 を渡して全体の
+制限時間を変えられる（SDK には渡さない）。
+"""
+import os
+import time
+import asyncio
+import threading
+
+import instrumentation
+from resilience import RetryPolicy, CircuitBreaker, DeadlineExceeded, is_retryable
+
+# 接続プールと同時実行数の既定値（環境変数で上書きできる）
+DEFAULT_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "32"))
+DEFAULT_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "16"))
+DEFAULT_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+DEFAULT_CONCURRENCY = int(os.environ.get("OPENAI_CONCURRENCY", "16"))
+DEFAULT_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "120"))
+
+
+class ClientClosed(RuntimeError):
+    """閉じたクライアント（API キーが変わって置き換えられたものなど）を使おうとした"""
+
+
+class SharedOpenAIClient:
+    def __init__(self, api_key=None, base_url=None, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive_connections=DEFAULT_MAX_KEEPALIVE, keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+                 concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, retry_policy=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.attempt_timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        # 実行中の呼び出しの数。close() のあとは、これが 0 になってからイベントループを止める
+        self._in_flight = 0
+        self._closed = False
+        self._state_lock = threading.Lock()
+        self._options = dict(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                             keepalive_expiry=keepalive_expiry, timeout=timeout)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="openai-client", daemon=True)
+        self._thread.start()
+
+        # httpx のクライアントとセマフォはイベントループに紐づくので、ループの中で作る
+        self._client, self._http, self._semaphore = self._submit(self._create()).result()
+
+    async def _create(self):
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        options = self._options
+        http = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=options["max_connections"],
+                                max_keepalive_connections=options["max_keepalive_connections"],
+                                keepalive_expiry=options["keepalive_expiry"]),
+            timeout=httpx.Timeout(options["timeout"], connect=10.0),
+        )
+        client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http, max_retries=0)
+        return client, http, asyncio.Semaphore(self.concurrency)
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _begin(self):
+        with self._state_lock:
+            if self._closed:
+                raise ClientClosed("このクライアントは閉じられています（get_client で取得し直してください）")
+            self._in_flight += 1
+
+    def _end(self):
+        with self._state_lock:
+            self._in_flight -= 1
+            shutdown = self._closed and self._in_flight == 0
+        if shutdown:
+            self._shutdown()
+
+    def _shutdown(self):
+        async def _close():
+            try:
+                await self._client.close()
+            finally:
+                self._loop.stop()
+        self._submit(_close())
+
+    def breaker(self, path, model=None):
+        """エンドポイントとモデルの組ごとのサーキットブレーカー"""
+        name = f"{path}:{model}" if model else path
+        with self._breakers_lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name)
+                self._breakers[name] = breaker
+            return breaker
+
+    async def _guarded(self, path, kwargs, deadline=None):
+        method = self._resolve(path)
+        breaker = self.breaker(path, kwargs.get("model"))
+        policy = self.retry_policy
+        deadline_at = time.monotonic() + (deadline if deadline is not None else policy.deadline)
+        attempt = 0
+        while True:
+            attempt += 1
+            breaker.check()
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"{path}: {attempt - 1} 回試行しましたが制限時間を超えました")
+            try:
+                # 同時に送るリクエスト数を concurrency までに抑える（再試行の待ち時間は枠を空ける）
+                async with self._semaphore:
+                    result = await asyncio.wait_for(method(**kwargs), min(self.attempt_timeout, remaining))
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # 400 や認証エラーなどは API 自体は応答しているので、ブレーカーでは成功として扱う
+                    breaker.record(True)
+                    raise
+                breaker.record(False)
+                if attempt >= policy.max_attempts:
+                    raise
+                delay = policy.backoff(attempt, e)
+                if time.monotonic() + delay >= deadline_at:
+                    raise
+                print(f"[openai retry] {path} {attempt}回目失敗: {type(e).__name__} → {delay:.2f}秒後に再試行")
+                await asyncio.sleep(delay)
+            else:
+                breaker.record(True)
+                return result
+
+    def _resolve(self, path):
+        """"chat.completions.create" のような名前から AsyncOpenAI のメソッドを取り出す"""
+        target = self._client
+        for name in path.split("."):
+            target = getattr(target, name)
+        return target
+
+    def call(self, path, deadline=None, **kwargs):
+        """任意のスレッドから同期的に API を呼ぶ（結果が返るまで待つ）"""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("クライアントのイベントループ内では acall を使ってください")
+        # 計測は呼び出し元のスレッドで行う（イベントループのスレッドには呼び出し元のトレースが見えない）
+        self._begin()
+        try:
+            with instrumentation.span("openai." + path, model=kwargs.get("model")):
+                return self._submit(self._guarded(path, kwargs, deadline)).result()
+        finally:
+            self._end()
+
+    async def acall(self, path, deadline=None, **kwargs):
+        """任意のイベントループから API を呼ぶ（await がキャンセルされるとリクエストも中断する）"""
+        # await の間は他のリクエストも同じスレッドで動くので、CPU 時間は記録しない
+        self._begin()
+        try:
+            with instrumentation.span("openai." + path, cpu=False, model=kwargs.get("model")):
+                return await asyncio.wrap_future(self._submit(self._guarded(path, kwargs, deadline)))
+        finally:
+            self._end()
+
+    # よく使う API の呼び出し
+    def chat_completion(self, **kwargs):
+        return self.call("chat.completions.create", **kwargs)
+
+    def generate_image(self, **kwargs):
+        return self.call("images.generate", **kwargs)
+
+    def edit_image(self, **kwargs):
+        return self.call("images.edit", **kwargs)
+
+    async def achat_completion(self, **kwargs):
+        return await self.acall("chat.completions.create", **kwargs)
+
+    async def agenerate_image(self, **kwargs):
+        return await self.acall("images.generate", **kwargs)
+
+    async def aedit_image(self, **kwargs):
+        return await self.acall("images.edit", **kwargs)
+
+    def breaker_states(self):
+        with self._breakers_lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+    def close(self):
+        """
+        クライアントを閉じる。以後の呼び出しは ClientClosed になる
+
+        実行中の呼び出しがあれば、それが終わってから接続プールとイベントループを止める。
+        """
+        with self._state_lock:
+            if self._closed:
+                return
+            self._closed = True
+            idle = self._in_flight == 0
+        if idle:
+            self._shutdown()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key=None, base_url=None, **options):
+    """
+    接続先ごとに1つのクライアントを共有して返す
+
+    同じキーで何度呼んでも接続プールは作り直さない。options は最初に作るときだけ使われる。
+    GUI で別の API キーが入力されたときは、前のキーのクライアント（接続プールとイベントループの
+    スレッド）を閉じてから作り直す。
+    """
+    old = None
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None or client.api_key != api_key:
+            old = client
+            client = SharedOpenAIClient(api_key=api_key, base_url=base_url, **options)
+            _clients[base_url] = client
+    if old is not None:
+        try:
+            old.close()
+        except Exception as e:
+            print(f"前の API キーのクライアントを閉じられませんでした: {e}")
+    return client
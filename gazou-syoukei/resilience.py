@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+OpenAI API 呼び出しの再試行・タイムアウト・サーキットブレーカー
+
+openai_client.py がすべての呼び出しに使う。
+  - 1回の試行は attempt_timeout 秒、再試行を含めた全体は deadline 秒で打ち切る
+  - 429 / 5xx / 接続エラー / タイムアウトは、ジッター付きの指数バックオフで再試行する
+    （Retry-After ヘッダーがあればその秒数以上待つ）
+  - 失敗率が高くなったら CircuitBreaker が開き、しばらくは API を呼ばずに CircuitOpen を投げる。
+    呼び出し側は例外を受けてすぐにローカルの代替処理（輪郭の象形文字・オフラインの説明など）に切り替えられる
+"""
+import os
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get("OPENAI_MAX_ATTEMPTS", "3"))
+DEFAULT_BASE_DELAY = float(os.environ.get("OPENAI_BACKOFF_BASE", "0.5"))
+DEFAULT_MAX_DELAY = float(os.environ.get("OPENAI_BACKOFF_MAX", "8"))
+DEFAULT_DEADLINE = float(os.environ.get("OPENAI_DEADLINE", "180"))
+
+DEFAULT_BREAKER_THRESHOLD = float(os.environ.get("OPENAI_BREAKER_THRESHOLD", "0.5"))
+DEFAULT_BREAKER_WINDOW = int(os.environ.get("OPENAI_BREAKER_WINDOW", "20"))
+DEFAULT_BREAKER_MIN_CALLS = int(os.environ.get("OPENAI_BREAKER_MIN_CALLS", "5"))
+DEFAULT_BREAKER_COOLDOWN = float(os.environ.get("OPENAI_BREAKER_COOLDOWN", "30"))
+
+# 再試行する HTTP ステータス（タイムアウト・競合・レート制限・サーバーエラー）
+RETRYABLE_STATUS = frozenset((408, 409, 429, 500, 502, 503, 504))
+
+
+class CircuitOpen(Exception):
+    """サーキットブレーカーが開いているため API を呼ばなかった"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name}: 失敗が続いているため {retry_in:.0f} 秒間は API を呼びません")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class DeadlineExceeded(TimeoutError):
+    """再試行を含めた呼び出し全体が deadline を超えた"""
+
+
+def is_retryable(error):
+    """一時的な失敗（再試行すれば成功する可能性がある）なら True"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(error, (openai.APIConnectionError, openai.APITimeoutError))
+
+
+def retry_after(error):
+    """エラー応答の Retry-After（秒）。なければ None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY, deadline=DEFAULT_DEADLINE):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt, error=None):
+        """attempt 回目（1 始まり）の失敗の後に待つ秒数（full jitter。Retry-After があればそれ以上）"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        server_delay = retry_after(error) if error is not None else None
+        if server_delay is not None:
+            delay = max(delay, server_delay)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    直近 window 回の呼び出しのうち threshold 以上が失敗したら開き、cooldown 秒は呼び出しを止める
+
+    cooldown が過ぎると1回だけ試しに通し（半開）、成功すれば閉じ、失敗すればまた開く。
+    """
+
+    def __init__(self, name, threshold=DEFAULT_BREAKER_THRESHOLD, window=DEFAULT_BREAKER_WINDOW,
+                 min_calls=DEFAULT_BREAKER_MIN_CALLS, cooldown=DEFAULT_BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened_count = 0
+        self.rejected = 0
+        self._results = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        """呼び出してよければ何もせず、止めるべきなら CircuitOpen を投げる"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            retry_in = self._opened_at + self.cooldown - time.monotonic()
+            if self.state == "open" and retry_in <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+            raise CircuitOpen(self.name, max(0.0, retry_in))
+
+    def record(self, success):
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+                if success:
+                    self.state = "closed"
+                    self._results.clear()
+                else:
+                    self._open()
+                return
+
+            self._results.append(success)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.threshold:
+                self._open()
+
+    def release(self):
+        """半開の試し呼び出しが結果を出さずに終わった（キャンセルなど）ときに呼ぶ"""
+        with self._lock:
+            self._probing = False
+
+    def _open(self):
+        self.state = "open"
+        self.opened_count += 1
+        self._opened_at = time.monotonic()
+        self._results.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "opened": self.opened_count, "rejected": self.rejected,
+                    "recent_failures": self._results.count(False), "recent_calls": len(self._results)}
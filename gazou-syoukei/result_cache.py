@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+象形文字の変換結果キャッシュ
+
+キーは「画像ファイルの内容のハッシュ + 変換パラメータ + engine.ENGINE_VERSION」。同じ画像を
+同じパラメータでもう一度変換したときは、輪郭処理をやり直さずに前回の結果を返す
+（engine.py の出力が変わったら ENGINE_VERSION を上げるので、ディスクの古い結果は使われない）。
+メモリ上は LRU で件数を制限し、cache_dir を指定するとディスクにも保存する。
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+
+import engine
+
+# ファイルの署名 → 内容のハッシュ を覚えておく件数
+MAX_FILE_HASHES = 1024
+
+
+class ResultCache:
+    def __init__(self, max_entries=64, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._file_hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def file_hash(self, image_path):
+        """画像ファイルの内容のハッシュ（ファイルが変わっていなければ読み直さない）"""
+        stat = os.stat(image_path)
+        signature = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            content_hash = self._file_hashes.get(signature)
+            if content_hash is not None:
+                self._file_hashes.move_to_end(signature)
+                return content_hash
+
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+        with self._lock:
+            self._file_hashes[signature] = content_hash
+            while len(self._file_hashes) > MAX_FILE_HASHES:
+                self._file_hashes.popitem(last=False)
+        return content_hash
+
+    @staticmethod
+    def make_key(content_hash, **params):
+        """画像のハッシュと変換パラメータ（canny_threshold1 など）と engine のバージョンからキーを作る"""
+        payload = json.dumps([content_hash, engine.ENGINE_VERSION, sorted(params.items())])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """(象形文字の配列, 特徴量) を返す。キャッシュになければ None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._load_from_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, character, features):
+        entry = (character, features)
+        with self._lock:
+            self._remember(key, entry)
+        self._save_to_disk(key, character, features)
+
+    def _remember(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_paths(self, key):
+        directory = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(directory, key + ".png"), os.path.join(directory, key + ".json")
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        image_path, features_path = self._disk_paths(key)
+        if not os.path.exists(features_path):
+            return None
+        try:
+            character = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+            with open(features_path, "r", encoding="utf-8") as f:
+                features = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if character is None:
+            return None
+        return character, features
+
+    def _save_to_disk(self, key, character, features):
+        if not self.cache_dir:
+            return
+        image_path, features_path = self._disk_paths(key)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+
+        # 他のプロセスが読み込み中でも壊れたファイルが見えないように、一時ファイル経由で置き換える
+        ok, png = cv2.imencode(".png", character)
+        if not ok:
+            return
+        suffix = f".{os.getpid()}.tmp"
+        with open(image_path + suffix, "wb") as f:
+            f.write(png.tobytes())
+        os.replace(image_path + suffix, image_path)
+
+        # 特徴量のファイルを最後に書くので、これがあれば画像も揃っている
+        with open(features_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(features, f, ensure_ascii=False)
+        os.replace(features_path + suffix, features_path)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -4,13 +4,13 @@
 import os
 import io
 import json
+import base64
 import tkinter as tk
 from tkinter import filedialog, scrolledtext
 from PIL import Image, ImageTk
-import openai
-import requests
-import time
-import datetime
+
+import instrumentation
+import openai_client
 
 class HieroglyphApp:
     def __init__(self):
@@ -23,7 +23,8 @@ class HieroglyphApp:
         api_key = data.get('api_key')
         if not api_key:
             raise RuntimeError("api_key.json に 'api_key' が定義されていません")
-        openai.api_key = api_key
+        # 画像の編集は共有クライアントの接続プールで行う
+        self.client = openai_client.get_client(api_key=api_key)
 
         self.root = tk.Tk()
         self.root.title("象形文字変換アプリ")
@@ -52,6 +53,11 @@ class HieroglyphApp:
         # 状態保持
         self.input_path = None
         self.input_image = None
+        self.input_bytes = None
+        self.input_mime = None
+        self.output_image = None
+        # 画像サイズごとのマスク（PNG のバイト列）
+        self.mask_cache = {}
 
     def log_print(self, msg: str):
         """テキストボックスに追記＆自動スクロール"""
@@ -71,7 +77,11 @@ class HieroglyphApp:
             ])
         if not path:
             return
-        img = Image.open(path)
+        # API に送るバイト列は読み込み時に一度だけ読んでおく
+        with open(path, "rb") as f:
+            self.input_bytes = f.read()
+        img = Image.open(io.BytesIO(self.input_bytes))
+        self.input_mime = Image.MIME.get(img.format, "application/octet-stream")
         self.input_image = img.copy()
         self.input_path = path
         self.display_on_canvas(img, self.canvas_input)
@@ -87,57 +97,52 @@ class HieroglyphApp:
         canvas.delete("all")
         canvas.create_image(128, 128, image=tk_img)
 
+    def mask_png(self, size):
+        """指定サイズの白いマスクを PNG のバイト列で返す（サイズごとに一度だけ作る）"""
+        png = self.mask_cache.get(size)
+        if png is None:
+            buffer = io.BytesIO()
+            Image.new("RGBA", size, (255, 255, 255, 255)).save(buffer, format="PNG")
+            png = buffer.getvalue()
+            self.mask_cache[size] = png
+        return png
+
     def convert_image(self):
         if not self.input_path:
             return
         self.log_print("[開始] 画像を象形文字に変換中…")
-        start_time = time.time()
-        self.log_print(f"[{datetime.datetime.now()}] convert_image メソッド開始")
-        
-        mask = Image.new("RGBA", self.input_image.size, (255, 255, 255, 255))
-        mask_path = os.path.join(os.getcwd(), "mask.png")
-        mask.save(mask_path)
         
-        api_start = time.time()
-        self.log_print(f"[{datetime.datetime.now()}] API呼び出し送信")
-        try:
-            with open(self.input_path, "rb") as img_f, open(mask_path, "rb") as mask_f:
-                resp = openai.Image.create_edit(
-                    image=img_f,
-                    mask=mask_f,
+        # 段階ごとの時間は instrumentation のトレースで測る（TRACE=1 なら JSON Lines にも書き出される）
+        with instrumentation.trace("test.edit_image", always=True, source=os.path.basename(self.input_path)) as trace:
+            # マスクと入力画像はメモリ上のバイト列のまま渡す（再試行しても同じ内容を送れる）
+            with instrumentation.span("mask"):
+                mask = self.mask_png(self.input_image.size)
+            image_name = os.path.basename(self.input_path)
+            
+            self.log_print("[送信] API呼び出し")
+            try:
+                resp = self.client.edit_image(
+                    image=(image_name, self.input_bytes, self.input_mime),
+                    mask=("mask.png", mask, "image/png"),
                     prompt="象形文字の画像を生成してください",
                     n=1,
-                    size="512x512"
+                    size="512x512",
+                    response_format="b64_json"
                 )
-                api_end = time.time()
-                self.log_print(f"[{datetime.datetime.now()}] API応答受信 ({api_end - api_start:.2f}秒)")
-        except Exception as e:
-            self.log_print(f"[エラー] API呼び出しに失敗しました: {e}")
-            return
-        
-        url = resp["data"][0]["url"]
-        self.log_print(f"[完了] 生成画像のURL取得: {url}")
-        
-        dl_start = time.time()
-        self.log_print(f"[{datetime.datetime.now()}] 画像ダウンロード開始")
-        try:
-            r = requests.get(url)
-            r.raise_for_status()
-            dl_end = time.time()
-            self.log_print(f"[{datetime.datetime.now()}] 画像ダウンロード完了 ({dl_end - dl_start:.2f}秒)")
-        except Exception as e:
-            self.log_print(f"[エラー] 画像ダウンロード失敗: {e}")
-            return
-        
-        gen_img = Image.open(io.BytesIO(r.content))
-        out_path = os.path.join(os.getcwd(), "generated.png")
-        gen_img.save(out_path)
-        self.log_print(f"[保存] {out_path}")
-        
-        self.display_on_canvas(gen_img, self.canvas_output)
-        self.log_print("[完了] ウィンドウに表示しました")
-        total_end = time.time()
-        self.log_print(f"[{datetime.datetime.now()}] convert_image メソッド完了 (合計 {(total_end - start_time):.2f}秒)")
+            except Exception as e:
+                self.log_print(f"[エラー] API呼び出しに失敗しました: {e}")
+                return
+            
+            # 生成画像は URL ではなく base64 で受け取るので、ダウンロードは不要
+            with instrumentation.span("decode"):
+                gen_img = Image.open(io.BytesIO(base64.b64decode(resp.data[0].b64_json)))
+                gen_img.load()
+            self.output_image = gen_img
+            self.log_print(f"[完了] 生成画像を受信しました ({gen_img.size[0]}x{gen_img.size[1]})")
+            
+            with instrumentation.span("display"):
+                self.display_on_canvas(gen_img, self.canvas_output)
+        self.log_print(f"[完了] ウィンドウに表示しました（{trace.summary()}）")
 
     def run(self):
         self.root.mainloop()
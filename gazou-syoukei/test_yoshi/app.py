@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os, json, base64
-from pathlib import Path
-from flask import Flask, request, jsonify, render_template
-from openai import OpenAI
+import asyncio
+from flask import Flask, Response, request, jsonify, render_template
+
+# 変換処理は ASGI 版（asgi_app.py）と共通
+import conversion
+import instrumentation
+import upload
+from conversion import model_stats, prompt_cache, image_cache, upload_stats
+from hedged_generation import DEFAULT_HEDGE_DELAY
 
-# ── API キー ───────────────────────────────────────────
-api_key = "APIキーを入れてください"
-client = OpenAI(api_key=api_key)
 app = Flask(__name__)
+# これを超えるアップロードは本体を読み込む前に 413 で断る
+app.config["MAX_CONTENT_LENGTH"] = upload.MAX_UPLOAD_BYTES
 
 # ── 画面 ──────────────────────────────────────────────
 @app.route("/")
@@ -16,73 +20,35 @@ def index():
     return render_template("index.html")
 
 # ── /convert ─────────────────────────────────────────
+# 1リクエストがワーカーを占有するので、同時に多数を受けるときは asgi_app.py を使う
 @app.route("/convert", methods=["POST"])
 def convert():
     if "image" not in request.files:
         return jsonify(error="no file"), 400
-    img_bytes = request.files["image"].read()
-
-    # ① GPT-4o-mini に「画像生成用プロンプト + ラベル」を作らせる
-    data_uri = "data:image/png;base64," + base64.b64encode(img_bytes).decode()
-
+    # アップロードは一時ファイルにスプールされているので、read() せずに直接デコードする
     try:
-        chat = client.chat.completions.create(
-            model="gpt-4o",
-            temperature=0.2,
-            messages=[
-                {"role": "system",
-                 "content": (
-                     "You are an expert prompt engineer for image generation. "
-                     "Return ONLY valid JSON like "
-                     "{\"prompt\":\"...\",\"label\":\"...\"}. "
-                     "The prompt must include the Japanese word '象形文字' and instruct the generator to draw the object "
-                     "as a single 象形文字 (black strokes, no fill, "
-                     "transparent background, <=20 English words). "
-                     "label = short English noun of the object."
-                 )},
-                {"role": "user",
-                 "content": [
-                     {"type": "text",
-                      "text": "Convert this photo into a single pictogram. "
-                              "Analyse the object and craft the prompt."},
-                     {"type": "image_url", "image_url": {"url": data_uri}}
-                 ]
-                }
-            ],
-            response_format={"type": "json_object"}
-        )
-        obj = json.loads(chat.choices[0].message.content)
-        prompt = obj.get("prompt") or "A simple black-stroke pictogram."
-        label  = obj.get("label") or "object"
-    except Exception as e:
-        print("[prompt-gen error]", e)
-        prompt = ("A simple black-stroke pictogram of an unknown object, "
-                  "transparent background, no shading.")
-        label = "unknown"
-
-    # ② 画像生成 ─ gpt-image-1 → dall-e-3 → dall-e-2
-    for model in ("gpt-image-1", "dall-e-3", "dall-e-2"):
-        try:
-            gen = client.images.generate(
-                model=model,
-                prompt=prompt,
-                n=1,
-                size="512x512",
-                response_format="b64_json"
-            )
-            b64_png = gen.data[0].b64_json
-            break
-        except Exception as e:
-            print(f"[{model} failed] {e}")
-    else:
-        return jsonify(error="all models failed"), 500
-
-    return jsonify(
-        image="data:image/png;base64," + b64_png,
-        label=label,
-        prompt=prompt,
-        model_used=model
-    )
+        with upload.mapped(request.files["image"].stream) as data:
+            result = asyncio.run(conversion.convert_image(data))
+    except conversion.ConversionFailed as e:
+        return jsonify(error=str(e)), 500
+    return jsonify(**result)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify(error="file too large", max_bytes=upload.MAX_UPLOAD_BYTES), 413
+
+# ── /stats ───────────────────────────────────────────
+@app.route("/stats")
+def stats():
+    return jsonify(hedge_delay=DEFAULT_HEDGE_DELAY, models=model_stats.snapshot(),
+                   prompt_cache=prompt_cache.stats(), image_cache=image_cache.stats(),
+                   vision_upload=upload_stats.snapshot(), openai=conversion.client.breaker_states(),
+                   stages=instrumentation.metrics.snapshot())
+
+# ── /metrics（Prometheus 形式。段階ごとの集計は TRACE=1 のときだけ増える） ──
+@app.route("/metrics")
+def metrics():
+    return Response(instrumentation.prometheus_text(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Flask 版（app.py）の ASGI 版
+
+/convert の処理はほとんどが OpenAI API の応答待ちなので、1つのイベントループで
+多数のリクエストを同時に待たせる。同時に変換する数（CONVERT_CONCURRENCY）と、
+空きを待てる数（CONVERT_QUEUE_DEPTH）を超えたリクエストにはすぐ 503 を返す。
+
+  uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+
+OpenAI API への同時リクエスト数は openai_client.py の OPENAI_CONCURRENCY /
+OPENAI_MAX_CONNECTIONS で別に制限されるので、合わせて大きくしておく。
+"""
+import os
+import asyncio
+import contextlib
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemLoader
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import conversion
+import instrumentation
+import upload
+from conversion import model_stats, prompt_cache, image_cache, upload_stats
+from hedged_generation import DEFAULT_HEDGE_DELAY
+
+# 同時に変換する数・空きを待てる数・503 のときに返す Retry-After（秒）
+CONVERT_CONCURRENCY = int(os.environ.get("CONVERT_CONCURRENCY", "256"))
+CONVERT_QUEUE_DEPTH = int(os.environ.get("CONVERT_QUEUE_DEPTH", "512"))
+RETRY_AFTER = int(os.environ.get("CONVERT_RETRY_AFTER", "5"))
+
+
+class Overloaded(Exception):
+    """同時実行数も待ち行列もいっぱい"""
+
+
+class ConcurrencyLimiter:
+    def __init__(self, concurrency, queue_depth):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def check(self):
+        """空きがなく待ち行列もいっぱいなら Overloaded を投げる"""
+        if self._semaphore.locked() and self.waiting >= self.queue_depth:
+            self.rejected += 1
+            raise Overloaded()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        self.check()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def snapshot(self):
+        return {"concurrency": self.concurrency, "queue_depth": self.queue_depth,
+                "active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+
+limiter = ConcurrencyLimiter(CONVERT_CONCURRENCY, CONVERT_QUEUE_DEPTH)
+
+# Flask 版と同じテンプレートを使う（url_for は static ファイルだけ対応）
+templates = Environment(loader=FileSystemLoader(str(Path(__file__).resolve().parent / "templates")),
+                        autoescape=True)
+templates.globals["url_for"] = lambda endpoint, filename="": f"/{endpoint}/{filename}"
+
+
+def overloaded_response():
+    return JSONResponse({"error": "server busy"}, status_code=503,
+                        headers={"Retry-After": str(RETRY_AFTER)})
+
+
+def too_large_response():
+    return JSONResponse({"error": "file too large", "max_bytes": upload.MAX_UPLOAD_BYTES}, status_code=413)
+
+
+# ── 画面 ──────────────────────────────────────────────
+async def index(request):
+    return HTMLResponse(templates.get_template("index.html").render())
+
+
+# ── /convert ─────────────────────────────────────────
+async def convert(request):
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > upload.MAX_UPLOAD_BYTES:
+        return too_large_response()
+
+    # 本体を読む前に枠を取る（いっぱいならアップロードを受け取らずに 503 を返し、
+    # 待っている間は本体を読まないので、過負荷のときにアップロードがメモリや帯域を使わない）
+    try:
+        async with limiter.slot():
+            return await _convert_upload(request)
+    except Overloaded:
+        return overloaded_response()
+
+
+async def _convert_upload(request):
+    # 本体は受信しながら数え、上限を超えたらそこで打ち切る（ファイル部分は一時ファイルにスプールされる）
+    limited = Request(request.scope, upload.limit_receive(request.receive))
+    try:
+        form = await limited.form()
+    except upload.UploadTooLarge:
+        return too_large_response()
+
+    try:
+        image_file = form.get("image")
+        if image_file is None or isinstance(image_file, str):
+            return JSONResponse({"error": "no file"}, status_code=400)
+        with upload.mapped(image_file.file) as data:
+            result = await conversion.convert_image(data)
+    except conversion.ConversionFailed as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+    finally:
+        await form.close()
+    return JSONResponse(result)
+
+
+# ── /stats ───────────────────────────────────────────
+async def stats(request):
+    return JSONResponse({"hedge_delay": DEFAULT_HEDGE_DELAY, "models": model_stats.snapshot(),
+                         "prompt_cache": prompt_cache.stats(), "image_cache": image_cache.stats(),
+                         "vision_upload": upload_stats.snapshot(), "openai": conversion.client.breaker_states(),
+                         "convert": limiter.snapshot(), "stages": instrumentation.metrics.snapshot()})
+
+
+# ── /metrics（Prometheus 形式。段階ごとの集計は TRACE=1 のときだけ増える） ──
+async def metrics(request):
+    return PlainTextResponse(instrumentation.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+app = Starlette(routes=[
+    Route("/", index),
+    Route("/convert", convert, methods=["POST"]),
+    Route("/stats", stats),
+    Route("/metrics", metrics),
+])
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=int(os.environ.get("PORT", "8000")))
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+/convert の変換処理（Flask 版と ASGI 版で共通）
+
+① GPT-4o で画像生成用のプロンプトとラベルを作る
+② 画像生成モデルをヘッジ付きで呼び出す
+③ すべて失敗したら engine.py の輪郭処理で象形文字を作る
+
+convert_image() は async 関数なので、ASGI 版では多数のリクエストを1つのイベントループで
+同時に待てる。Flask 版は asyncio.run() で呼ぶ。
+"""
+import os
+import sys
+import json
+import base64
+import asyncio
+from pathlib import Path
+
+import cv2
+
+# 親ディレクトリ（gazou-syoukei）の共通モジュール（輪郭処理エンジン・OpenAIクライアント）を使う
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import engine
+import instrumentation
+import openai_client
+import vision_upload
+from hedged_generation import hedged_generate, AllModelsFailed, LatencyStats, IMAGE_MODELS
+from image_cache import ImageCache
+from prompt_cache import PromptCache, image_hash
+
+# ── API キー ───────────────────────────────────────────
+# 環境変数 OPENAI_API_KEY があればそちらを使う（fake_openai.py で負荷試験をするときなど）
+api_key = os.environ.get("OPENAI_API_KEY", "APIキーを入れてください")
+client = openai_client.get_client(api_key=api_key)
+
+# 画像生成モデルごとの応答時間（/stats で確認してヘッジの待ち時間を調整する）
+model_stats = LatencyStats()
+
+# ほぼ同じ写真がまたアップロードされたときは、前回のプロンプトとラベルを使う
+prompt_cache = PromptCache()
+
+# 画像認識 API に送った画像のサイズ（縮小・再圧縮でどれだけ減らせたか）
+upload_stats = vision_upload.UploadStats()
+
+# 同じプロンプトで生成済みの画像はディスクから返す
+image_cache = ImageCache()
+IMAGE_SIZE = "512x512"
+
+# プロンプト生成は短い応答なので、これ以上かかる場合は汎用のプロンプトで先に進む
+PROMPT_DEADLINE = float(os.environ.get("PROMPT_DEADLINE", "30"))
+
+PROMPT_SYSTEM_MESSAGE = (
+    "You are an expert prompt engineer for image generation. "
+    "Return ONLY valid JSON like "
+    "{\"prompt\":\"...\",\"label\":\"...\"}. "
+    "The prompt must include the Japanese word '象形文字' and instruct the generator to draw the object "
+    "as a single 象形文字 (black strokes, no fill, "
+    "transparent background, <=20 English words). "
+    "label = short English noun of the object."
+)
+
+
+class ConversionFailed(Exception):
+    """画像生成モデルも輪郭処理も象形文字を作れなかった"""
+
+
+# ── 輪郭ベースの象形文字（画像生成APIがすべて失敗したときの代替） ──
+def contour_pictogram_b64(image):
+    """読み込み済みの画像（decode_for_vision の結果）から輪郭の象形文字を作り、base64 の PNG を返す"""
+    if image is None:
+        return None
+    character, _ = engine.generate_character(engine.to_gray(image), working_size=engine.DEFAULT_WORKING_SIZE)
+    if character is None:
+        return None
+    with instrumentation.span("encode"):
+        ok, png = cv2.imencode(".png", character)
+    return base64.b64encode(png.tobytes()).decode() if ok else None
+
+
+async def generate_prompt(data, image):
+    """
+    GPT-4o に「画像生成用プロンプト + ラベル」を作らせ、(プロンプト, ラベル, 汎用か) を返す
+
+    data はアップロードされた画像データ、image はそれを decode_for_vision で読み込んだもの。
+    失敗したとき（プロンプトが返ってこなかったときも）は汎用のプロンプトを返し、3つ目が True になる。
+    汎用のプロンプトはどの写真でも同じなので、呼び出し側は生成した画像をキャッシュしないこと。
+    """
+    key = image_hash(image) if image is not None else None
+    cached = prompt_cache.get(key)
+    if cached is not None:
+        return (*cached, False)
+
+    data_uri, report = await asyncio.to_thread(vision_upload.encode_for_vision, data, image)
+    upload_stats.record(report)
+    print("[vision-upload]", vision_upload.format_report(report))
+    try:
+        chat = await client.achat_completion(
+            model="gpt-4o",
+            temperature=0.2,
+            messages=[
+                {"role": "system", "content": PROMPT_SYSTEM_MESSAGE},
+                {"role": "user",
+                 "content": [
+                     {"type": "text",
+                      "text": "Convert this photo into a single pictogram. "
+                              "Analyse the object and craft the prompt."},
+                     {"type": "image_url", "image_url": {"url": data_uri}}
+                 ]
+                }
+            ],
+            response_format={"type": "json_object"},
+            deadline=PROMPT_DEADLINE
+        )
+        obj = json.loads(chat.choices[0].message.content)
+        generic = not obj.get("prompt")
+        prompt = obj.get("prompt") or "A simple black-stroke pictogram."
+        label = obj.get("label") or "object"
+        if not generic:
+            prompt_cache.put(key, (prompt, label))
+    except Exception as e:
+        print("[prompt-gen error]", e)
+        prompt = ("A simple black-stroke pictogram of an unknown object, "
+                  "transparent background, no shading.")
+        label = "unknown"
+        generic = True
+    return prompt, label, generic
+
+
+async def convert_image(data):
+    """
+    アップロードされた画像を象形文字に変換し、/convert の応答に使う dict を返す
+
+    data は bytes または mmap（upload.mapped）。どの方法でも作れなかった場合は ConversionFailed を投げる。
+    TRACE=1 のときは段階ごとの処理時間を1行の JSON として記録する。
+    """
+    with instrumentation.trace("convert", upload_bytes=len(data)) as trace:
+        result = await _convert(data)
+        trace.annotate(model_used=result["model_used"])
+        return result
+
+
+async def _convert(data):
+    # 画像は縮小しながら1回だけ読み込み、知覚ハッシュ・API に送る画像・輪郭処理のすべてに使う
+    image = await asyncio.to_thread(vision_upload.decode_for_vision, data)
+    prompt, label, generic = await generate_prompt(data, image)
+
+    # 汎用のプロンプトで作った画像は別の写真の結果なので、キャッシュから返さないし保存もしない
+    cached = None if generic else await asyncio.to_thread(image_cache.get, prompt, IMAGE_MODELS, IMAGE_SIZE)
+    if cached is not None:
+        model, png = cached
+        return {
+            "image": "data:image/png;base64," + base64.b64encode(png).decode(),
+            "label": label,
+            "prompt": prompt,
+            "model_used": model,
+        }
+
+    # 画像生成 ─ gpt-image-1 → dall-e-3 → dall-e-2
+    # 前のモデルが IMAGE_HEDGE_DELAY 秒以内に返らなければ次のモデルも並行して呼び、最初の成功を使う
+    try:
+        model, b64_png = await hedged_generate(
+            client, prompt, stats=model_stats,
+            n=1, size=IMAGE_SIZE, response_format="b64_json"
+        )
+        if not generic:
+            await asyncio.to_thread(image_cache.put, prompt, model, IMAGE_SIZE, base64.b64decode(b64_png))
+    except AllModelsFailed:
+        # 輪郭処理は CPU を使うので、イベントループを止めないように別スレッドで実行する
+        b64_png = await asyncio.to_thread(contour_pictogram_b64, image)
+        if b64_png is None:
+            raise ConversionFailed("all models failed")
+        model = "contour"
+
+    return {
+        "image": "data:image/png;base64," + b64_png,
+        "label": label,
+        "prompt": prompt,
+        "model_used": model,
+    }
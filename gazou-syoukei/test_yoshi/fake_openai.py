@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenAI API のローカルの代役（負荷試験・動作確認用）
+
+chat.completions / images.generate / images.edit を、指定した応答時間の分布と
+エラー率で返す。本物の API を使わずに /convert の同時実行数やキャッシュの効果を確かめられる。
+
+使い方:
+    python fake_openai.py --port 8777 --chat-latency lognormal:0.8:0.4 --image-latency lognormal:6:0.3 \\
+        --error-rate 0.02 --model-error-rate gpt-image-1=0.3
+
+    # 別の端末で（API キーは ASCII なら何でもよい）
+    OPENAI_BASE_URL=http://127.0.0.1:8777/v1 OPENAI_API_KEY=fake uvicorn asgi_app:app --port 8000
+
+応答時間の指定（秒）:
+    fixed:0.5              … 常に 0.5 秒
+    uniform:0.2:1.5        … 0.2〜1.5 秒の一様分布
+    exp:0.8                … 平均 0.8 秒の指数分布
+    lognormal:0.8:0.4      … 中央値 0.8 秒、σ=0.4 の対数正規分布（実際の API に近い裾の長さ）
+
+エラーは --error-status の中からランダムに選び、429 / 503 には Retry-After を付ける。
+"""
+import sys
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 画像生成モデルごとの既定の応答時間（中央値・秒）。--model-latency で上書きできる
+DEFAULT_MODEL_LATENCY = {
+    "gpt-image-1": "lognormal:8:0.35",
+    "dall-e-3": "lognormal:6:0.3",
+    "dall-e-2": "lognormal:3:0.3",
+}
+
+# 生成した「象形文字」として返すプロンプトの候補（同じ画像には同じものを返す）
+_OBJECTS = ("cup", "tree", "bird", "fish", "house", "mountain", "sun", "hand", "eye", "river")
+
+
+def parse_latency(spec):
+    """応答時間の指定を、秒を返す関数に変換する"""
+    kind, *values = spec.split(":")
+    try:
+        values = [float(v) for v in values]
+        if kind == "fixed":
+            value, = values
+            return lambda rng: value
+        if kind == "uniform":
+            low, high = values
+            return lambda rng: rng.uniform(low, high)
+        if kind == "exp":
+            mean, = values
+            return lambda rng: rng.expovariate(1 / mean) if mean > 0 else 0.0
+        if kind == "lognormal":
+            median, sigma = values
+            return lambda rng: median * rng.lognormvariate(0, sigma)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"応答時間の指定が正しくありません: {spec}")
+
+
+def _png(width, height, gray):
+    """単色のグレースケール PNG（標準ライブラリだけで作る）"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    raw = b"".join(b"\x00" + bytes([gray]) * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b""))
+
+
+class FakeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def record(self, endpoint, status):
+        with self._lock:
+            entry = self.counts.setdefault(endpoint, {})
+            entry[status] = entry.get(status, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(entry) for endpoint, entry in self.counts.items()}
+
+
+class FakeOpenAI:
+    """応答の中身と、応答時間・エラーの決め方"""
+
+    def __init__(self, chat_latency, image_latency=None, model_latency=None, error_rate=0.0,
+                 model_error_rate=None, error_status=(429, 500, 503), retry_after=1, seed=None):
+        self.chat_latency = chat_latency
+        self.image_latency = image_latency
+        self.model_latency = {model: parse_latency(spec) for model, spec in DEFAULT_MODEL_LATENCY.items()}
+        self.model_latency.update(model_latency or {})
+        self.error_rate = error_rate
+        self.model_error_rate = model_error_rate or {}
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.stats = FakeStats()
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._image = base64.b64encode(_png(64, 64, 0)).decode()
+
+    def _draw(self, func):
+        with self._rng_lock:
+            return func(self._rng)
+
+    def latency(self, endpoint, model):
+        if endpoint == "chat":
+            return self._draw(self.chat_latency)
+        if self.image_latency is not None:
+            return self._draw(self.image_latency)
+        sampler = self.model_latency.get(model) or self.model_latency["dall-e-2"]
+        return self._draw(sampler)
+
+    def error(self, model):
+        """返すエラーのステータス（エラーにしないなら None）"""
+        rate = self.model_error_rate.get(model, self.error_rate)
+        if rate and self._draw(lambda rng: rng.random()) < rate:
+            return self._draw(lambda rng: rng.choice(self.error_status))
+        return None
+
+    def chat_content(self, body):
+        text = "\n".join(message["content"] if isinstance(message.get("content"), str)
+                         else json.dumps(message.get("content"), ensure_ascii=False)
+                         for message in body.get("messages") or [])
+        if (body.get("response_format") or {}).get("type") != "json_object":
+            return "この象形文字は、古代の人々が大切にしたものを表しています。"
+        if '"descriptions"' in text:
+            # descriptions.build_batch_prompt の [番号] ごとに説明を返す
+            count = text.count("- 画像名:")
+            return json.dumps({"descriptions": [
+                {"id": i, "description": f"この象形文字は{i}番目の形を表しています。"} for i in range(count)]},
+                ensure_ascii=False)
+        # 同じ画像（data URI）には同じプロンプトを返す（キャッシュの効果を確かめられるように）
+        label = _OBJECTS[zlib.crc32(text.encode("utf-8")) % len(_OBJECTS)]
+        return json.dumps({"prompt": f"A single 象形文字 of a {label}, black strokes, transparent background",
+                           "label": label}, ensure_ascii=False)
+
+    def respond(self, endpoint, body):
+        model = body.get("model") or ("dall-e-2" if endpoint == "images" else "gpt-4o")
+        time.sleep(self.latency(endpoint, model))
+        status = self.error(model)
+        if status is not None:
+            return status, {"error": {"message": f"fake {status}", "type": "fake_error"}}
+
+        if endpoint == "chat":
+            return 200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": self.chat_content(body)}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        count = int(body.get("n") or 1)
+        return 200, {"created": int(time.time()), "data": [{"b64_json": self._image} for _ in range(count)]}
+
+
+ROUTES = {
+    "/v1/chat/completions": "chat",
+    "/v1/images/generations": "images",
+    "/v1/images/edits": "images",
+}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload, headers=None):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send(200, fake.stats.snapshot())
+            else:
+                self._send(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            endpoint = ROUTES.get(self.path.split("?")[0])
+            raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if endpoint is None:
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            try:
+                # images.edit はマルチパートなので中身は見ない
+                body = json.loads(raw) if self.headers.get("Content-Type", "").startswith("application/json") else {}
+            except ValueError:
+                self._send(400, {"error": {"message": "invalid JSON"}})
+                return
+
+            status, payload = fake.respond(endpoint, body)
+            fake.stats.record(endpoint, status)
+            headers = {"Retry-After": str(fake.retry_after)} if status in (429, 503) else None
+            try:
+                self._send(status, payload, headers)
+            except (BrokenPipeError, ConnectionResetError):
+                # クライアントがタイムアウトやキャンセルで先に切断した
+                pass
+
+    return Handler
+
+
+def _model_option(value, parse):
+    model, _, spec = value.partition("=")
+    if not spec:
+        raise argparse.ArgumentTypeError(f"モデル名=値 の形で指定してください: {value}")
+    return model, parse(spec)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI API のローカルの代役を起動します")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8777)
+    parser.add_argument("--chat-latency", type=parse_latency, default=parse_latency("lognormal:0.8:0.4"),
+                        help="chat.completions の応答時間（既定: lognormal:0.8:0.4）")
+    parser.add_argument("--image-latency", type=parse_latency, default=None,
+                        help="全画像生成モデル共通の応答時間（既定: モデルごとの値）")
+    parser.add_argument("--model-latency", action="append", default=[],
+                        type=lambda v: _model_option(v, parse_latency), metavar="MODEL=SPEC",
+                        help="モデルごとの応答時間（例: gpt-image-1=lognormal:8:0.35）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="エラーにする割合（0〜1）")
+    parser.add_argument("--model-error-rate", action="append", default=[],
+                        type=lambda v: _model_option(v, float), metavar="MODEL=RATE",
+                        help="モデルごとのエラー率（例: gpt-image-1=0.3）")
+    parser.add_argument("--error-status", default="429,500,503",
+                        help="返すエラーのステータス（カンマ区切り、既定: 429,500,503）")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 / 503 に付ける Retry-After（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="乱数の種（応答時間とエラーを再現する）")
+    args = parser.parse_args(argv)
+
+    fake = FakeOpenAI(args.chat_latency, args.image_latency, dict(args.model_latency), args.error_rate,
+                      dict(args.model_error_rate), tuple(int(s) for s in args.error_status.split(",")),
+                      args.retry_after, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    server.daemon_threads = True
+    print(f"OpenAI の代役: http://{args.host}:{args.port}/v1 （件数は /stats、Ctrl+C で終了）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(fake.stats.snapshot(), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
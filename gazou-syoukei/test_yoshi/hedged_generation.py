@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+画像生成モデルのヘッジ付き呼び出し
+
+gpt-image-1 → dall-e-3 → dall-e-2 を順番に待つのではなく、前のモデルが
+hedge_delay 秒たっても返ってこなければ次のモデルも並行して呼び出し、
+最初に成功した結果を採用して残りはキャンセルする。失敗したときは待たずに次へ進む。
+
+  hedge_delay = 0     … 全モデルを同時に呼ぶ
+  hedge_delay = None  … 失敗したときだけ次を呼ぶ（従来の順番どおりの動作）
+
+モデルごとの応答時間は LatencyStats に記録され、hedge_delay の調整に使える。
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+
+IMAGE_MODELS = ("gpt-image-1", "dall-e-3", "dall-e-2")
+
+
+def _delay_from_env():
+    value = os.environ.get("IMAGE_HEDGE_DELAY", "15")
+    return None if value.lower() in ("", "none", "off") else float(value)
+
+
+DEFAULT_HEDGE_DELAY = _delay_from_env()
+
+
+class AllModelsFailed(Exception):
+    def __init__(self, errors):
+        super().__init__("all models failed: " + ", ".join(f"{m}: {e}" for m, e in errors.items()))
+        self.errors = errors
+
+
+class LatencyStats:
+    """モデルごとの成功・失敗・キャンセル数と、成功時の応答時間（直近 window 件）"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def _entry(self, model):
+        entry = self._models.get(model)
+        if entry is None:
+            entry = {"success": 0, "failure": 0, "cancelled": 0, "latencies": deque(maxlen=self.window)}
+            self._models[model] = entry
+        return entry
+
+    def record(self, model, outcome, latency=None):
+        with self._lock:
+            entry = self._entry(model)
+            entry[outcome] += 1
+            if outcome == "success" and latency is not None:
+                entry["latencies"].append(latency)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for model, entry in self._models.items():
+                latencies = sorted(entry["latencies"])
+                result[model] = {
+                    "success": entry["success"],
+                    "failure": entry["failure"],
+                    "cancelled": entry["cancelled"],
+                    "p50": _percentile(latencies, 50),
+                    "p95": _percentile(latencies, 95),
+                    "max": latencies[-1] if latencies else None,
+                }
+            return result
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return round(sorted_values[index], 3)
+
+
+async def _attempt(client, model, prompt, stats, request_options):
+    start = time.perf_counter()
+    try:
+        gen = await client.agenerate_image(model=model, prompt=prompt, **request_options)
+        b64_png = gen.data[0].b64_json
+        if not b64_png:
+            raise ValueError("empty image")
+    except asyncio.CancelledError:
+        stats.record(model, "cancelled")
+        raise
+    except Exception:
+        stats.record(model, "failure")
+        raise
+    stats.record(model, "success", time.perf_counter() - start)
+    return b64_png
+
+
+async def hedged_generate(client, prompt, models=IMAGE_MODELS, hedge_delay=DEFAULT_HEDGE_DELAY, stats=None,
+                          **request_options):
+    """
+    最初に成功したモデルの (モデル名, base64 の PNG) を返す
+
+    すべて失敗した場合は AllModelsFailed を投げる。request_options は images.generate にそのまま渡す。
+    """
+    stats = stats if stats is not None else LatencyStats()
+    waiting = list(models)
+    running = {}
+    errors = {}
+
+    def launch_next():
+        model = waiting.pop(0)
+        task = asyncio.ensure_future(_attempt(client, model, prompt, stats, request_options))
+        running[task] = model
+
+    launch_next()
+    while waiting and hedge_delay == 0:
+        launch_next()
+    try:
+        while running:
+            # 次のモデルが残っていれば hedge_delay だけ待ち、間に合わなければ次も並行して呼ぶ
+            timeout = hedge_delay if waiting and hedge_delay is not None else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch_next()
+                continue
+
+            for task in done:
+                model = running.pop(task)
+                if task.exception() is None:
+                    return model, task.result()
+                errors[model] = task.exception()
+                print(f"[{model} failed] {task.exception()}")
+
+            # 失敗したら待たずに次のモデルへ
+            if waiting:
+                launch_next()
+    finally:
+        # 採用されなかった呼び出しはキャンセルする
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    raise AllModelsFailed(errors)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+画像生成 API の結果（PNG）のキャッシュ
+
+キーは「正規化したプロンプト + モデル + サイズ」。"cup" や "dog" のように同じラベルの
+プロンプトがまた来たときは、API を呼ばずにディスク（SQLite）から返す。
+合計サイズが max_bytes を超えたら、最後に使われたのが古いものから消す。
+"""
+import os
+import re
+import time
+import sqlite3
+import threading
+
+DEFAULT_PATH = os.environ.get("IMAGE_CACHE_PATH",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_cache.sqlite3"))
+DEFAULT_MAX_BYTES = int(float(os.environ.get("IMAGE_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+
+def normalize_prompt(prompt):
+    """大文字小文字・空白・末尾の句読点の違いを無視する"""
+    return re.sub(r"\s+", " ", prompt).strip().rstrip(".。!！ ").lower()
+
+
+class ImageCache:
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        # Flask のスレッドや asyncio.to_thread から使うので、1つの接続をロックで守る
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                prompt    TEXT NOT NULL,
+                model     TEXT NOT NULL,
+                size      TEXT NOT NULL,
+                png       BLOB NOT NULL,
+                bytes     INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (prompt, model, size)
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used)")
+        self._db.commit()
+
+    def get(self, prompt, models, size):
+        """models の順に探し、最初に見つかった (モデル名, PNG のバイト列) を返す。なければ None"""
+        key = normalize_prompt(prompt)
+        with self._lock:
+            for model in models:
+                row = self._db.execute("SELECT png FROM images WHERE prompt = ? AND model = ? AND size = ?",
+                                       (key, model, size)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE images SET last_used = ? WHERE prompt = ? AND model = ? AND size = ?",
+                                     (time.time(), key, model, size))
+                    self._db.commit()
+                    self.hits += 1
+                    return model, row[0]
+            self.misses += 1
+            return None
+
+    def put(self, prompt, model, size, png):
+        if len(png) > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)",
+                             (normalize_prompt(prompt), model, size, png, len(png), time.time()))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM images").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT rowid, bytes FROM images ORDER BY last_used").fetchall()
+        for rowid, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM images WHERE rowid = ?", (rowid,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM images").fetchone()
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": entries, "bytes": total, "max_bytes": self.max_bytes}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/convert の負荷試験
+
+決まった同時実行数で /convert に画像をアップロードし続け、応答時間（p50 / p95 / p99）・
+スループット・エラー率を表示する。fake_openai.py と組み合わせると、ネットワークや
+API の利用料なしにデプロイの大きさやキャッシュ・同時実行数の変更の効果を確かめられる。
+
+使い方:
+    python fake_openai.py --port 8777 &
+    OPENAI_BASE_URL=http://127.0.0.1:8777/v1 OPENAI_API_KEY=fake \\
+        IMAGE_CACHE_PATH=/tmp/load_test_cache.sqlite3 uvicorn asgi_app:app --port 8000 &
+    python load_test.py http://127.0.0.1:8000 --concurrency 64 --requests 2000 --distinct 50
+
+アップロードする画像は --images のディレクトリから読むか、--distinct 枚の合成画像を使う
+（枚数を減らすとキャッシュに当たりやすくなる）。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+PERCENTILES = (50, 95, 99)
+
+
+def synthesize_images(count, size=768, seed=0):
+    """図形を描いた JPEG を count 枚作る（同じ seed なら毎回同じ画像）"""
+    import cv2
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        img = np.full((size, size, 3), 255, np.uint8)
+        center = rng.integers(size // 4, size * 3 // 4, 2)
+        points = center + rng.integers(-size // 4, size // 4, (int(rng.integers(3, 8)), 2))
+        color = tuple(int(c) for c in rng.integers(0, 160, 3))
+        cv2.fillPoly(img, [points.astype(np.int32)], color)
+        cv2.circle(img, tuple(int(c) for c in rng.integers(0, size, 2)), int(rng.integers(10, size // 6)), color, 4)
+        ok, data = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        images.append((f"synthetic_{i}.jpg", data.tobytes(), "image/jpeg"))
+    return images
+
+
+def load_images(directory):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), "rb") as f:
+                mime = "image/png" if name.lower().endswith(".png") else "image/jpeg"
+                images.append((name, f.read(), mime))
+    return images
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.models = {}
+
+    def record(self, latency, status, model=None):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if model:
+            self.models[model] = self.models.get(model, 0) + 1
+
+    def summary(self, elapsed):
+        total = len(self.latencies)
+        ok = self.statuses.get(200, 0)
+        latencies = np.asarray(self.latencies) if total else np.zeros(1)
+        return {
+            "requests": total,
+            "elapsed": round(elapsed, 3),
+            "throughput": round(total / elapsed, 2) if elapsed else None,
+            "error_rate": round(1 - ok / total, 4) if total else None,
+            "latency": {f"p{p}": round(float(np.percentile(latencies, p)), 3) for p in PERCENTILES},
+            "latency_max": round(float(latencies.max()), 3),
+            "status": {str(k): v for k, v in sorted(self.statuses.items(), key=lambda kv: str(kv[0]))},
+            "model_used": self.models,
+        }
+
+
+async def convert_once(client, url, image, recorder):
+    name, data, mime = image
+    start = time.perf_counter()
+    try:
+        response = await client.post(url, files={"image": (name, data, mime)})
+        model = None
+        if response.status_code == 200:
+            model = response.json().get("model_used")
+        recorder.record(time.perf_counter() - start, response.status_code, model)
+    except httpx.HTTPError as e:
+        recorder.record(time.perf_counter() - start, type(e).__name__)
+
+
+async def run_load(base_url, images, concurrency, requests=None, duration=None, timeout=300.0, seed=0):
+    """concurrency 件を常に実行中に保ち、requests 件（または duration 秒）送る"""
+    url = base_url.rstrip("/") + "/convert"
+    recorder = Recorder()
+    rng = random.Random(seed)
+    sent = 0
+    deadline = time.perf_counter() + duration if duration else None
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker():
+            nonlocal sent
+            while True:
+                if requests is not None and sent >= requests:
+                    return
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                sent += 1
+                await convert_once(client, url, rng.choice(images), recorder)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return recorder.summary(elapsed)
+
+
+def fetch_stats(base_url):
+    """サーバーの /stats（キャッシュのヒット率など）。取れなければ None"""
+    try:
+        return httpx.get(base_url.rstrip("/") + "/stats", timeout=10).json()
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def print_summary(summary, server_stats):
+    latency = summary["latency"]
+    print(f"リクエスト: {summary['requests']}件 / {summary['elapsed']:.1f}秒 "
+          f"({summary['throughput']}件/秒)")
+    print(f"応答時間: p50 {latency['p50']:.2f}秒, p95 {latency['p95']:.2f}秒, p99 {latency['p99']:.2f}秒, "
+          f"最大 {summary['latency_max']:.2f}秒")
+    print(f"エラー率: {summary['error_rate']:.1%}  ステータス: {summary['status']}")
+    if summary["model_used"]:
+        print(f"使われたモデル: {summary['model_used']}")
+    if server_stats:
+        for key in ("convert", "prompt_cache", "image_cache"):
+            if key in server_stats:
+                print(f"サーバー {key}: {json.dumps(server_stats[key], ensure_ascii=False)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="/convert に決まった同時実行数で負荷をかけます")
+    parser.add_argument("base_url", help="対象のアプリ（例: http://127.0.0.1:8000）")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時に送るリクエスト数")
+    parser.add_argument("--requests", type=int, default=None, help="送るリクエストの総数（既定: 200）")
+    parser.add_argument("--duration", type=float, default=None, help="送り続ける秒数（--requests の代わり）")
+    parser.add_argument("--images", default=None, help="アップロードする画像のディレクトリ")
+    parser.add_argument("--distinct", type=int, default=20, help="合成画像の枚数（--images がないとき）")
+    parser.add_argument("--timeout", type=float, default=300.0, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="画像と送る順番の乱数の種")
+    parser.add_argument("--output", default=None, help="結果を JSON で保存する")
+    args = parser.parse_args(argv)
+
+    images = load_images(args.images) if args.images else synthesize_images(args.distinct, seed=args.seed)
+    if not images:
+        print("アップロードする画像がありません")
+        return 1
+    requests = args.requests if args.requests is not None or args.duration else 200
+
+    print(f"{args.base_url}/convert に同時 {args.concurrency} 件で送信します（画像 {len(images)} 枚）")
+    summary = asyncio.run(run_load(args.base_url, images, args.concurrency, requests, args.duration,
+                                   args.timeout, args.seed))
+    server_stats = fetch_stats(args.base_url)
+    print_summary(summary, server_stats)
+
+    if args.output:
+        summary["concurrency"] = args.concurrency
+        summary["server"] = server_stats
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
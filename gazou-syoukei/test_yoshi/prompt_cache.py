@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+GPT-4o が作った「画像生成用プロンプト + ラベル」のキャッシュ
+
+キーは画像の知覚ハッシュ（dHash, 64 bit）。同じ商品をほぼ同じ角度で撮った写真は
+ハッシュのハミング距離が小さくなるので、max_distance 以内の画像が以前に
+アップロードされていれば、画像認識の API を呼ばずにそのときのプロンプトを使う。
+古い結果は ttl 秒で期限切れになり、件数は max_entries までに抑える（LRU）。
+"""
+import os
+import sys
+import time
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import engine
+
+DEFAULT_MAX_DISTANCE = int(os.environ.get("PROMPT_CACHE_DISTANCE", "6"))
+DEFAULT_TTL = float(os.environ.get("PROMPT_CACHE_TTL", "86400"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("PROMPT_CACHE_SIZE", "2048"))
+
+# dHash は 9x8 に縮小して横に隣り合う画素の大小を比べる（8x8 = 64 bit）
+_HASH_SIZE = 8
+_BIT_WEIGHTS = 1 << np.arange(_HASH_SIZE * _HASH_SIZE, dtype=np.uint64)
+
+
+def image_hash(image):
+    """読み込み済みの画像（グレースケールまたは BGR）の dHash（64 bit の int）を返す"""
+    gray = engine.to_gray(image)
+    small = cv2.resize(gray, (_HASH_SIZE + 1, _HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(_BIT_WEIGHTS[bits].sum())
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class PromptCache:
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # ハッシュ -> (保存した時刻, 値)
+        self._lock = threading.Lock()
+
+    def get(self, image_hash):
+        """距離が max_distance 以内で一番近い画像の値を返す。なければ None"""
+        if image_hash is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            best_hash, best_distance = None, self.max_distance + 1
+            for cached_hash in self._entries:
+                distance = hamming_distance(image_hash, cached_hash)
+                if distance < best_distance:
+                    best_hash, best_distance = cached_hash, distance
+                    if distance == 0:
+                        break
+            if best_hash is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_hash)
+            return self._entries[best_hash][1]
+
+    def put(self, image_hash, value):
+        if image_hash is None or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[image_hash] = (time.monotonic(), value)
+            self._entries.move_to_end(image_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _expire(self, now):
+        expired = [h for h, (stored, _) in self._entries.items() if now - stored > self.ttl]
+        for h in expired:
+            del self._entries[h]
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "max_distance": self.max_distance, "ttl": self.ttl}
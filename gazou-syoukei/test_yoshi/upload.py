@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+/convert のアップロードの受け取り
+
+アップロードは Flask / Starlette がサイズに応じて一時ファイルに書き出す（スプール）ので、
+ここではそれを read() でメモリに読み込まずに mmap で参照し、OpenCV に直接デコードさせる。
+1リクエストあたりのメモリは、縮小して読み込んだ画像の分だけで済む。
+受け付けるサイズの上限は UPLOAD_MAX_MB（既定: 20）。
+"""
+import io
+import os
+import mmap
+import contextlib
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("UPLOAD_MAX_MB", "20")) * 1024 * 1024)
+
+# これより小さいアップロードは mmap せずにそのまま読み込む（一時ファイルがメモリ上にあるため）
+_READ_IN_MEMORY_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """アップロードが MAX_UPLOAD_BYTES を超えた"""
+
+
+def limit_receive(receive, max_bytes=MAX_UPLOAD_BYTES):
+    """ASGI の receive を包み、リクエスト本体が max_bytes を超えた時点で UploadTooLarge を投げる"""
+    received = 0
+
+    async def _receive():
+        nonlocal received
+        message = await receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise UploadTooLarge()
+        return message
+
+    return _receive
+
+
+@contextlib.contextmanager
+def mapped(file):
+    """
+    スプールされたアップロード（ファイルオブジェクト）を読み取り専用のバッファとして開く
+
+    ディスクに書き出されていれば mmap を、小さいものは bytes を返す。
+    どちらも engine.decode_color / decode_gray にそのまま渡せる。
+    """
+    file.seek(0, io.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    if size <= _READ_IN_MEMORY_BYTES:
+        yield file.read()
+        return
+
+    try:
+        fileno = file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        yield file.read()
+        return
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as buffer:
+        yield buffer
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+画像認識 API（gpt-4o）に送る画像の前処理
+
+スマートフォンの写真をそのまま base64 で送ると、数 MB のリクエストになるうえ、
+API 側でも結局は縮小される。ここでは画像を1回だけ（JPEG はデコード時に縮小しながら）
+読み込み、長辺 VISION_MAX_SIDE まで縮小して JPEG / WebP に圧縮し直し、
+正しい MIME タイプの data URI にする。削減できたバイト数は report に入る。
+"""
+import os
+import base64
+import threading
+
+import cv2
+import numpy as np
+
+import engine
+import instrumentation
+
+# gpt-4o は高解像度モードでも短辺 768px 程度に縮小して見るので、それ以上は送らない
+VISION_MAX_SIDE = int(os.environ.get("VISION_MAX_SIDE", "1024"))
+VISION_IMAGE_FORMAT = os.environ.get("VISION_IMAGE_FORMAT", "jpeg").lower()
+VISION_IMAGE_QUALITY = int(os.environ.get("VISION_IMAGE_QUALITY", "85"))
+
+_ENCODERS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+# 先頭のバイト列から MIME タイプを判定する（再エンコードできなかったときに使う）
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+)
+
+
+def sniff_mime_type(data):
+    head = memoryview(data)[:16].tobytes()
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return "application/octet-stream"
+
+
+# 透明部分を持てる形式（JPEG には透明部分がないので縮小読み込みのまま）
+_ALPHA_MIME_TYPES = ("image/png", "image/webp", "image/gif")
+
+
+def flatten_alpha(img):
+    """
+    透明部分のある画像（BGRA）を白い背景に合成した BGR にする
+
+    IMREAD_COLOR で読むと透明部分が黒になり、商品の輪郭や画像認識の結果が変わってしまう。
+    16 bit の画像は 8 bit に、グレースケールは BGR にそろえる。
+    """
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    if img.shape[2] != 4:
+        return img
+    alpha = img[:, :, 3:].astype(np.float32) / 255
+    white = np.float32(255) * (1 - alpha)
+    return (img[:, :, :3] * alpha + white).round().astype(np.uint8)
+
+
+def decode_for_vision(data, max_side=VISION_MAX_SIDE):
+    """
+    画像データをカラーで読み込み、長辺 max_side 以下に縮小して返す。読み込めなければ None
+
+    PNG / WebP / GIF は透明部分を白にして返す（JPEG に圧縮し直しても黒くならないように）。
+    """
+    if sniff_mime_type(data) in _ALPHA_MIME_TYPES:
+        with instrumentation.span("decode"):
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+        if img is None:
+            return None
+        img, _ = engine.downscale(img, max_side)
+        return flatten_alpha(img)
+    img, _ = engine.decode_color(data, min_side=max_side)
+    if img is None:
+        return None
+    img, _ = engine.downscale(img, max_side)
+    return img
+
+
+@instrumentation.timed("vision_encode")
+def encode_for_vision(data, image, image_format=VISION_IMAGE_FORMAT, quality=VISION_IMAGE_QUALITY):
+    """
+    decode_for_vision の結果を圧縮して (data URI, report) を返す
+
+    image が None のとき、または元のデータのほうが小さいときは元のデータをそのまま送る。
+    report は mime_type / original_bytes / sent_bytes / saved_bytes / width / height の dict。
+    """
+    payload, mime_type = data, sniff_mime_type(data)
+    width = height = None
+    if image is not None:
+        height, width = image.shape[:2]
+        extension, encoded_mime_type, quality_flag = _ENCODERS[image_format]
+        ok, encoded = cv2.imencode(extension, image, [quality_flag, quality])
+        if ok and encoded.nbytes < len(data):
+            payload, mime_type = encoded.tobytes(), encoded_mime_type
+
+    report = {
+        "mime_type": mime_type,
+        "original_bytes": len(data),
+        "sent_bytes": len(payload),
+        "saved_bytes": len(data) - len(payload),
+        "width": width,
+        "height": height,
+    }
+    return f"data:{mime_type};base64," + base64.b64encode(payload).decode("ascii"), report
+
+
+def prepare_vision_image(data, max_side=VISION_MAX_SIDE, image_format=VISION_IMAGE_FORMAT):
+    """画像データを画像認識 API に送る (data URI, report) にする"""
+    return encode_for_vision(data, decode_for_vision(data, max_side), image_format)
+
+
+def format_report(report):
+    saved = report["saved_bytes"] / report["original_bytes"] * 100 if report["original_bytes"] else 0.0
+    return (f"{report['original_bytes']:,} B → {report['sent_bytes']:,} B "
+            f"({report['mime_type']}, {saved:.0f}% 削減)")
+
+
+class UploadStats:
+    """送信したリクエスト数と、元の画像・送信した画像の合計バイト数"""
+
+    def __init__(self):
+        self.requests = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, report):
+        with self._lock:
+            self.requests += 1
+            self.original_bytes += report["original_bytes"]
+            self.sent_bytes += report["sent_bytes"]
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": self.requests, "original_bytes": self.original_bytes,
+                    "sent_bytes": self.sent_bytes, "saved_bytes": self.original_bytes - self.sent_bytes}